@@ -13,6 +13,8 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -40,9 +42,24 @@ ADMIN_GROUP_NAME = os.environ.get('ADMIN_GROUP_NAME', 'Administration')
 
 SERVER_API_KEY = os.environ.get('SERVER_API_KEY', '123')
 
+# Shared with the metrics and document services, they verify access tokens with it
+JWT_SIGNING_KEY = os.environ.get('JWT_SIGNING_KEY')
+if not JWT_SIGNING_KEY:
+    raise ImproperlyConfigured('JWT_SIGNING_KEY is not set, access tokens can not be signed with a public default')
+
 METRICS_SERVICE_HOST = os.environ.get('METRICS_SERVICE_HOST', '127.0.0.1')
 METRICS_SERVICE_PORT = os.environ.get('METRICS_SERVICE_PORT', '8002')
 
+DOCUMENT_SERVICE_HOST = os.environ.get('DOCUMENT_SERVICE_HOST', '127.0.0.1')
+DOCUMENT_SERVICE_PORT = os.environ.get('DOCUMENT_SERVICE_PORT', '8003')
+
+# Principals served by /users/introspect/ are cached per user until their permissions or tokens change.
+# The default cache is local to the process, several workers need a shared backend to see the invalidations.
+INTROSPECTION_CACHE_TTL_SEC = int(os.environ.get('INTROSPECTION_CACHE_TTL_SEC', 300))
+
+# Seconds to wait for a service to evict the users it cached, it catches up with the token revocations anyway
+EVICT_PRINCIPALS_TIMEOUT_SEC = float(os.environ.get('EVICT_PRINCIPALS_TIMEOUT_SEC', 1))
+
 # custom settings end
 
 # Application definition
@@ -104,6 +121,14 @@ DATABASES = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=365),
+    'SIGNING_KEY': JWT_SIGNING_KEY,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
 }
 
 REST_FRAMEWORK = {
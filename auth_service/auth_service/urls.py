@@ -22,13 +22,12 @@ from django.urls import path, include
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
-from rest_framework_simplejwt.views import token_refresh
 
 from auth_service import settings
 from auth_service.settings import ADMIN_EMAIL, ADMIN_PASSWORD, ADMIN_GROUP_NAME
 from users.models import UserGroup, User, PermissionSet
 from users.urls import urlpatterns as user_urls
-from users.views import LoginView, LogoutView
+from users.views import LoginView, LogoutView, RefreshTokenView
 
 
 def create_admin():
@@ -66,7 +65,7 @@ schema_view = get_schema_view(
 urlpatterns = [
                   url(r'^swagger/$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
                   url(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-                  path('token/refresh/', token_refresh, name='Token refresh'),
+                  path('token/refresh/', RefreshTokenView.as_view(), name='Token refresh'),
                   path('login/', LoginView.as_view(), name='Login'),
                   path('logout/', LogoutView.as_view(), name='Logout'),
                   url(r'^users/', include(user_urls)),
@@ -0,0 +1,19 @@
+import logging
+from typing import List
+
+import requests
+
+from auth_service.settings import DOCUMENT_SERVICE_HOST, DOCUMENT_SERVICE_PORT, SERVER_API_KEY, \
+    EVICT_PRINCIPALS_TIMEOUT_SEC
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_SERVICE_URL = f'http://{DOCUMENT_SERVICE_HOST}:{DOCUMENT_SERVICE_PORT}'
+
+
+def evict_document_principals(user_ids: List[int]):
+    try:
+        requests.post(url=f'{DOCUMENT_SERVICE_URL}/documents/principals/evict/', json={'user_ids': user_ids},
+                      headers={'Server-Api-Key': SERVER_API_KEY}, timeout=EVICT_PRINCIPALS_TIMEOUT_SEC)
+    except requests.RequestException:
+        logger.warning('Document service did not evict the cached users %s', user_ids, exc_info=True)
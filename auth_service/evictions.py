@@ -0,0 +1,45 @@
+import logging
+import threading
+from typing import Iterable
+
+from document_api import evict_document_principals
+from metrics_api import evict_metrics_principals
+
+logger = logging.getLogger(__name__)
+
+
+class PrincipalEvictions:
+    """
+    Users whose cached principals or profiles the metrics and document services have to drop. The webhooks are
+    called by a background thread so that requests don't wait for them, users queued while a call is running are
+    announced together by the next one.
+    """
+
+    def __init__(self):
+        self._user_ids = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def put(self, user_ids: Iterable[int]):
+        with self._condition:
+            self._user_ids.update(user_ids)
+            # Started by the first eviction, a thread started before the server forks would not run in the workers
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='principal-evictions', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._user_ids:
+                    self._condition.wait()
+                user_ids, self._user_ids = sorted(self._user_ids), set()
+            try:
+                evict_metrics_principals(user_ids)
+                evict_document_principals(user_ids)
+            except Exception:
+                logger.exception('Cached users %s were not evicted', user_ids)
+
+
+principal_evictions = PrincipalEvictions()
@@ -1,6 +1,12 @@
+import logging
+from typing import List
+
 import requests
 
-from auth_service.settings import METRICS_SERVICE_PORT, METRICS_SERVICE_HOST
+from auth_service.settings import METRICS_SERVICE_PORT, METRICS_SERVICE_HOST, SERVER_API_KEY, \
+    EVICT_PRINCIPALS_TIMEOUT_SEC
+
+logger = logging.getLogger(__name__)
 
 METRICS_SERVICE_URL = f'http://{METRICS_SERVICE_HOST}:{METRICS_SERVICE_PORT}'
 
@@ -17,3 +23,12 @@ def delete_metrics_user(headers, user_id):
         return True
     else:
         return False
+
+
+def evict_metrics_principals(user_ids: List[int]):
+    try:
+        requests.post(url=f'{METRICS_SERVICE_URL}/metrics/principals/evict/', json={'user_ids': user_ids},
+                      headers={'Server-Api-Key': SERVER_API_KEY}, timeout=EVICT_PRINCIPALS_TIMEOUT_SEC)
+    except requests.RequestException:
+        logger.warning('Metrics service did not evict the cached users %s', user_ids, exc_info=True)
+
@@ -1,13 +1,19 @@
 import enum
 from enum import Enum
-from typing import List
+from typing import List, Iterable, Optional, Dict
 
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
+from django.core.cache import cache
 from django.db import models, transaction
+from django.db.models.signals import m2m_changed, pre_delete, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
+from auth_service.settings import INTROSPECTION_CACHE_TTL_SEC
+from evictions import principal_evictions
 from users.utils import generate_secret_key, generate_expiration_date
-from utils import AbstractCreateUpdateModel
+from utils import AbstractCreateUpdateModel, invalidate_counts_on_change
 
 
 class PermissionSet(enum.Enum):
@@ -68,6 +74,12 @@ class User(AbstractBaseUser, PermissionsMixin, AbstractCreateUpdateModel):
         super(User, self).save(*args, **kwargs)
         return self
 
+    def get_permission_names(self) -> List[str]:
+        permissions = set()
+        for user_group in self.user_groups.all():
+            permissions.update(set(user_group.permissions))
+        return list(permissions)
+
 
 class Invite(AbstractCreateUpdateModel):
     invitee = models.OneToOneField(User, on_delete=models.CASCADE, related_name='received_invitation')
@@ -85,18 +97,26 @@ class UserGroup(AbstractCreateUpdateModel):
 
     def set_permissions(self, permissions: List[str]):
         permissions_to_be_removed = list(set(self.permissions) - set(permissions))
+        user_ids = list(self.users.values_list('id', flat=True))
         if child_groups := self.child_groups.all():
             for group in child_groups:
-                group.remove_permissions(permissions_to_be_removed)
+                user_ids += group._remove_permissions(permissions_to_be_removed)
         self.permissions = permissions
         self.save()
+        TokenRevocation.revoke(user_ids)
 
     def remove_permissions(self, permissions: List[str]):
+        TokenRevocation.revoke(self._remove_permissions(permissions))
+
+    def _remove_permissions(self, permissions: List[str]) -> List[int]:
+        """Removes the permissions from the group and its child groups, returns the ids of the users of all of them"""
         self.permissions = list(set(self.permissions) - set(permissions))
+        user_ids = list(self.users.values_list('id', flat=True))
         if child_groups := self.child_groups.all():
             for group in child_groups:
-                group.remove_permissions(permissions)
+                user_ids += group._remove_permissions(permissions)
         self.save()
+        return user_ids
 
 
 class ContactInfo(AbstractCreateUpdateModel):
@@ -110,3 +130,77 @@ class ContactInfo(AbstractCreateUpdateModel):
     type = models.CharField(max_length=255)
     value = models.CharField(max_length=255)
     notes = models.CharField(max_length=255)
+
+
+class TokenRevocation(AbstractCreateUpdateModel):
+    """
+    Access tokens of the user issued before `revoked_before` are rejected. Copied by the metrics and document
+    services from /users/token-revocations/, their access tokens carry the permissions of the user so tokens
+    are revoked whenever those change too. Not a foreign key, the tokens of deleted users are revoked as well.
+    """
+    user_id = models.IntegerField(unique=True)
+    revoked_before = models.DateTimeField()
+
+    @classmethod
+    def revoke(cls, user_ids: Iterable[int]):
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return
+        now = timezone.now()
+        for user_id in user_ids:
+            cls.objects.update_or_create(user_id=user_id, defaults={'revoked_before': now})
+        # The services that cache users by token drop them right away instead of at the end of their TTL
+        transaction.on_commit(lambda: principal_evictions.put(user_ids))
+
+
+def principal_cache_key(user_id: int, revoked_before: float) -> str:
+    return f'principal:{user_id}:{revoked_before}'
+
+
+def get_principal(user_id: int) -> Optional[Dict]:
+    """
+    id, permission names and token revocation timestamp of the user, served by /users/introspect/ on the hot path
+    of the other services. Cached until the permissions or tokens of the user change, None for unknown users.
+    """
+    # Every change revokes the tokens of the user, keying by the revocation makes the entries of older revocations
+    # unreachable in all workers, including entries written by a request that read the user before the change
+    revoked_before = TokenRevocation.objects.filter(user_id=user_id).values_list('revoked_before', flat=True).first()
+    revoked_before = revoked_before.timestamp() if revoked_before else 0
+    key = principal_cache_key(user_id, revoked_before)
+    if (principal := cache.get(key)) is not None:
+        return principal
+    if not (user := User.objects.filter(id=user_id).prefetch_related('user_groups').first()):
+        return None
+    principal = {
+        'id': user.id,
+        'permissions': user.get_permission_names(),
+        'revoked_before': revoked_before,
+    }
+    cache.set(key, principal, INTROSPECTION_CACHE_TTL_SEC)
+    return principal
+
+
+@receiver(m2m_changed, sender=UserGroup.users.through)
+def revoke_members_tokens(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # instance is the user whose groups changed
+        TokenRevocation.revoke([instance.pk])
+    elif action == 'pre_clear':
+        TokenRevocation.revoke(instance.users.values_list('id', flat=True))
+    else:
+        TokenRevocation.revoke(pk_set)
+
+
+@receiver(pre_delete, sender=UserGroup)
+def revoke_group_tokens(sender, instance, **kwargs):
+    TokenRevocation.revoke(instance.users.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=User)
+def revoke_user_tokens(sender, instance, **kwargs):
+    TokenRevocation.revoke([instance.pk])
+
+
+invalidate_counts_on_change(User, UserGroup, Invite)
@@ -3,9 +3,11 @@ from django.contrib.auth.hashers import make_password
 from rest_framework import serializers
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.serializers import login_rule, user_eligible_for_login, PasswordField
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from users.models import User, Invite, UserGroup, ContactInfo
+from users.models import User, Invite, UserGroup, ContactInfo, TokenRevocation
+from users.utils import issue_access_token
 from utils import DefaultSerializer
 
 
@@ -33,10 +35,7 @@ class UserSerializer(serializers.ModelSerializer):
             return None
 
     def get_permissions(self, obj):
-        permissions = set()
-        for user_group in obj.user_groups.all():
-            permissions.update(set(user_group.permissions))
-        return list(permissions)
+        return obj.get_permission_names()
 
     def validate_password(self, value: str) -> str:
         return make_password(value)
@@ -126,7 +125,7 @@ class UserWithTokenSerializer(DefaultSerializer):
         data = {}
         refresh_token = self.get_token(user)
         data['refresh'] = str(refresh_token)
-        data['access'] = str(refresh_token.access_token)
+        data['access'] = str(issue_access_token(refresh_token, user))
 
         user_serializer = UserSerializer(user, context=self.context)
         data.update(user_serializer.data)
@@ -134,6 +133,33 @@ class UserWithTokenSerializer(DefaultSerializer):
         return data
 
 
+class RefreshAccessTokenSerializer(DefaultSerializer):
+    refresh = serializers.CharField()
+
+    def validate(self, attrs):
+        refresh_token = RefreshToken(attrs['refresh'])
+        user = User.objects.filter(id=refresh_token[api_settings.USER_ID_CLAIM]).first()
+        if not user:
+            raise AuthenticationFailed()
+        # With the current permissions, they may have changed since the refresh token was issued
+        return {'access': str(issue_access_token(refresh_token, user))}
+
+
+class TokenRevocationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TokenRevocation
+        fields = ('user_id', 'revoked_before')
+
+
+class TokenRevocationsQuerySerializer(DefaultSerializer):
+    since = serializers.DateTimeField(required=False)
+
+
+class IntrospectionSerializer(DefaultSerializer):
+    id = serializers.IntegerField()
+    permissions = serializers.ListField(child=serializers.CharField())
+
+
 class UserGroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserGroup
@@ -171,3 +197,4 @@ class UserGroupsQuerySerializer(DefaultSerializer):
 class UserListQuerySerializer(DefaultSerializer):
     user_group_id = serializers.IntegerField(required=False)
     only_admins = serializers.IntegerField(required=False)
+    ids = serializers.CharField(required=False)
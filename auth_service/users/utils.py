@@ -1,5 +1,6 @@
 import random
 import string
+import time
 from datetime import datetime
 
 from auth_service.settings import INVITATION_EXPIRATION_TIME
@@ -25,6 +26,17 @@ def generate_expiration_date():
     return datetime.utcnow() + INVITATION_EXPIRATION_TIME
 
 
+def issue_access_token(refresh_token, user):
+    """
+    Access token of `refresh_token` with the permissions of the user and its issue time, the metrics and document
+    services verify it locally and reject it when the tokens of the user were revoked after it was issued
+    """
+    access_token = refresh_token.access_token
+    access_token['permissions'] = user.get_permission_names()
+    access_token['iat'] = time.time()
+    return access_token
+
+
 def is_in_parent_group(user, current_group):
     parent_groups = set()
     while current_group.parent_group:
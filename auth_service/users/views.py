@@ -1,25 +1,30 @@
 from django.contrib.auth.hashers import make_password
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.mixins import RetrieveModelMixin
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
+from rest_framework_simplejwt.authentication import JWTTokenUserAuthentication
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 from rest_framework_simplejwt.views import TokenViewBase
 
 from auth_service.settings import ADMIN_GROUP_NAME
+from evictions import principal_evictions
 from metrics_api import delete_metrics_user
 from permissions import is_super_admin, ServerApiKeyAuthorized
-from users.models import User, Invite, UserGroup, ContactInfo
+from users.models import User, Invite, UserGroup, ContactInfo, TokenRevocation, get_principal
 from users.serializers import UserSerializer, UserWithTokenSerializer, AddUserSerializer, InviteSerializer, \
     AddUserToGroupSerializer, UserGroupSerializer, CreateUserGroupSerializer, AddUserGroupAdminSerializer, \
     PatchUserSerializer, UserGroupsQuerySerializer, ChangeUserPasswordSerializer, UserListQuerySerializer, \
-    ChangeUserGroupSerializer
+    ChangeUserGroupSerializer, RefreshAccessTokenSerializer, TokenRevocationSerializer, \
+    TokenRevocationsQuerySerializer, IntrospectionSerializer
 from users.utils import generate_random_email, generate_random_password, is_in_parent_group, is_admin_of_parent_group
 from utils import paginate, make_pagination_serializer
 
@@ -31,6 +36,7 @@ class LogoutView(APIView):
     def post(self, request):
         for token in request.user.outstandingtoken_set.all():
             BlacklistedToken.objects.get_or_create(token=token)
+        TokenRevocation.revoke([request.user.id])
 
         return Response(status=status.HTTP_205_RESET_CONTENT)
 
@@ -84,6 +90,7 @@ class SingleUserView(APIView):
                 ContactInfo.objects.create(**contact_info)
 
         user.save()
+        transaction.on_commit(lambda: principal_evictions.put([user.id]))
         return Response(UserSerializer(user, context={'request': request}).data)
 
     @swagger_auto_schema(responses={'200': UserSerializer})
@@ -115,16 +122,17 @@ class ChangeUserPasswordView(APIView):
 
         request.user.set_password(serializer.validated_data['new_password'])
         request.user.save()
+        TokenRevocation.revoke([request.user.id])
         return Response(data={})
 
 
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated | ServerApiKeyAuthorized])
 class GetAllUsersView(APIView):
 
     @swagger_auto_schema(responses={'200': make_pagination_serializer(UserSerializer)},
                          query_serializer=UserListQuerySerializer)
     def get(self, request, *args, **kwargs):
-        query = None
+        query = User.objects
         query_params = {k: v[0] for k, v in dict(request.query_params).items()}
         if user_group_id := query_params.pop('user_group_id', None):
             user_group = UserGroup.objects.filter(id=user_group_id).first()
@@ -134,11 +142,18 @@ class GetAllUsersView(APIView):
                 query = user_group.admins
             else:
                 query = user_group.users
+        if ids := query_params.pop('ids', None):
+            # Batch lookup of the other services, all the users fit in one page by default
+            if not all(s.strip().isdigit() for s in ids.split(',')):
+                return Response(data={'detail': 'ids has to be a comma separated list of user ids'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            query_params['id__in'] = ids
+            query_params.setdefault('page_size', len(ids.split(',')))
         return paginate(
             db_model=User,
             serializer=UserSerializer,
             request=request,
-            query=query,
+            query=query.prefetch_related('contact_infos', 'user_groups'),
             query_params=query_params
         )
 
@@ -147,6 +162,10 @@ class LoginView(TokenViewBase):
     serializer_class = UserWithTokenSerializer
 
 
+class RefreshTokenView(TokenViewBase):
+    serializer_class = RefreshAccessTokenSerializer
+
+
 class GetByInviteView(RetrieveModelMixin, GenericViewSet):
     serializer_class = InviteSerializer
     permission_classes = (AllowAny,)
@@ -182,6 +201,7 @@ class ConfirmInviteView(APIView):
         user.password = make_password(password)
         user.activated = True
         user.save()
+        transaction.on_commit(lambda: principal_evictions.put([user.id]))
         serializer = UserSerializer(user)
         return Response(data=serializer.data)
 
@@ -317,6 +337,7 @@ class ContactInfoRetrieveView(APIView):
             return Response(data={'detail': 'Contact info not found'}, status=status.HTTP_404_NOT_FOUND)
 
         contact_info.delete()
+        transaction.on_commit(lambda: principal_evictions.put([contact_info.user_id]))
 
         return Response(data={})
 
@@ -329,6 +350,34 @@ def get_user_info(request: Request, *args, **kwargs):
     return Response(ser.data)
 
 
+@swagger_auto_schema(method='GET', responses={'200': IntrospectionSerializer})
+@api_view(['GET'])
+@authentication_classes([JWTTokenUserAuthentication])
+@permission_classes([IsAuthenticated])
+def introspect(request: Request, *args, **kwargs):
+    # The user is only read from the token, its principal comes from the cache
+    principal = get_principal(request.user.id)
+    if not principal or request.auth.get('iat', 0) < principal['revoked_before']:
+        return Response(data={'detail': 'Token is invalid or revoked'}, status=status.HTTP_401_UNAUTHORIZED)
+    return Response(data={'id': principal['id'], 'permissions': principal['permissions']})
+
+
+@swagger_auto_schema(method='GET', responses={'200': TokenRevocationSerializer(many=True)},
+                     query_serializer=TokenRevocationsQuerySerializer)
+@api_view(['GET'])
+@permission_classes([ServerApiKeyAuthorized])
+def get_token_revocations(request: Request, *args, **kwargs):
+    serializer = TokenRevocationsQuerySerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+
+    synced_at = timezone.now()
+    # Older revocations can't reject any access token that hasn't expired
+    query = TokenRevocation.objects.filter(revoked_before__gt=synced_at - api_settings.ACCESS_TOKEN_LIFETIME)
+    if since := serializer.validated_data.get('since'):
+        query = query.filter(updated__gte=since)
+    return Response(data={'synced_at': synced_at, 'items': TokenRevocationSerializer(query, many=True).data})
+
+
 @swagger_auto_schema(method='GET', responses={'200': make_pagination_serializer(InviteSerializer)})
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
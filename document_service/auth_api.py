@@ -1,43 +1,217 @@
+import hashlib
+import logging
 import os
-from typing import Dict, List
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List, Optional, Iterable
 
+import jwt
 import requests
+from django.utils.dateparse import parse_datetime
 from pydantic import BaseModel
 
-from document_service.settings import AUTH_SERVICE_HOST, AUTH_SERVICE_PORT
+from document_service.settings import AUTH_SERVICE_HOST, AUTH_SERVICE_PORT, JWT_SIGNING_KEY, JWT_ALGORITHM, \
+    TOKEN_REVOCATIONS_SYNC_SEC, TOKEN_REVOCATIONS_MAX_STALENESS_SEC, AUTH_VERIFICATION, PRINCIPAL_CACHE_TTL_SEC, \
+    PRINCIPAL_CACHE_SIZE, INTROSPECTION_TIMEOUT_SEC
+
+logger = logging.getLogger(__name__)
 
 AUTH_API_URL = f"http://{AUTH_SERVICE_HOST}:{AUTH_SERVICE_PORT}"
 
 SERVER_API_KEY = os.environ.get('SERVER_API_KEY', '123')
 
+# Revocations committed while the previous sync was running are fetched again by the next one
+TOKEN_REVOCATIONS_OVERLAP = timedelta(seconds=60)
+
 
-class UserModel(BaseModel):
+class TokenUser(BaseModel):
     id: int
-    first_name: str
-    last_name: str
-    email: str
     permissions: List[str]
 
 
-def auth_user(headers: Dict[str, str]) -> bool:
-    if os.environ.get('DEBUG') == 'True':
-        return True
-    response = requests.get(url=f'{AUTH_API_URL}/users/auth-user/',
-                            headers={k.capitalize(): v for k, v in headers.items()})
-    return response.status_code == 200
+class TokenRevocations:
+    """
+    Copy of the token revocations of the auth service: user id -> time before which its access tokens are revoked.
+    A background thread, started by the first request, syncs the changes since the previous sync every
+    `sync_interval` seconds, or right away when the auth service announces a revocation. Requests never wait for a
+    sync except the first ones of the process. When no sync succeeded for `max_staleness` seconds the copy can't be
+    trusted, tokens are rejected until the auth service is reachable again.
+    """
+
+    def __init__(self, sync_interval: float, max_staleness: float):
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self._revoked_before = {}
+        self._since = None
+        self._synced = None
+        self._first_sync = threading.Event()
+        self._wake_up = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='token-revocations', daemon=True)
+                self._thread.start()
+
+    def expire(self):
+        """Syncs without waiting for the interval, called when the auth service announces a revocation"""
+        self._wake_up.set()
+
+    def is_stale(self) -> bool:
+        return self._synced is None or time.monotonic() - self._synced > self.max_staleness
+
+    def revoked_before(self, user_id: int) -> Optional[float]:
+        """Time before which the access tokens of the user are revoked, None while the copy is stale"""
+        self.start()
+        self._first_sync.wait(self.sync_interval)
+        if self.is_stale():
+            return None
+        return self._revoked_before.get(user_id, 0)
+
+    def _run(self):
+        while True:
+            self._wake_up.clear()
+            self._sync()
+            self._first_sync.set()
+            self._wake_up.wait(self.sync_interval)
+
+    def _sync(self):
+        started = time.monotonic()
+        try:
+            response = requests.get(url=f'{AUTH_API_URL}/users/token-revocations/',
+                                    params={'since': self._since.isoformat()} if self._since else None,
+                                    headers={'Server-Api-Key': SERVER_API_KEY}, timeout=self.sync_interval)
+            response.raise_for_status()
+            data = response.json()
+            for revocation in data['items']:
+                self._revoked_before[revocation['user_id']] = parse_datetime(revocation['revoked_before']).timestamp()
+            self._since = parse_datetime(data['synced_at']) - TOKEN_REVOCATIONS_OVERLAP
+            self._synced = started
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            if self.is_stale():
+                logger.error('Token revocations are stale, access tokens are rejected until a sync succeeds',
+                             exc_info=True)
+            else:
+                logger.warning('Token revocations sync failed, revoked tokens may be accepted', exc_info=True)
+
+
+token_revocations = TokenRevocations(sync_interval=TOKEN_REVOCATIONS_SYNC_SEC,
+                                     max_staleness=TOKEN_REVOCATIONS_MAX_STALENESS_SEC)
+
+
+class PrincipalCache:
+    """
+    Users resolved by the auth service, keyed by a hash of the Authorization header so that tokens are not kept
+    in memory. Entries live `ttl` seconds, the least recently used are dropped above `max_size`, and all entries
+    of a user are evicted as soon as the auth service announces that its tokens or permissions changed.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._principals = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(authorization: str) -> str:
+        return hashlib.sha256(authorization.encode()).hexdigest()
 
+    def get(self, authorization: str) -> Optional[TokenUser]:
+        key = self.key(authorization)
+        with self._lock:
+            if entry := self._principals.get(key):
+                user, expires = entry
+                if time.monotonic() < expires:
+                    self._principals.move_to_end(key)
+                    return user
+                del self._principals[key]
+        return None
 
-def get_request_user(headers: Dict[str, str]) -> UserModel:
-    response = requests.get(url=f'{AUTH_API_URL}/users/auth-user/',
-                            headers={k.capitalize(): v for k, v in headers.items()})
-    user = UserModel(**response.json())
+    def set(self, authorization: str, user: TokenUser):
+        key = self.key(authorization)
+        with self._lock:
+            self._principals[key] = (user, time.monotonic() + self.ttl)
+            self._principals.move_to_end(key)
+            while len(self._principals) > self.max_size:
+                self._principals.popitem(last=False)
+
+    def evict_users(self, user_ids: Iterable[int]):
+        user_ids = set(user_ids)
+        with self._lock:
+            for key in [key for key, (user, _) in self._principals.items() if user.id in user_ids]:
+                del self._principals[key]
+
+    def clear(self):
+        with self._lock:
+            self._principals.clear()
+
+
+principal_cache = PrincipalCache(ttl=PRINCIPAL_CACHE_TTL_SEC, max_size=PRINCIPAL_CACHE_SIZE)
+
+
+def evict_principals(user_ids: Iterable[int]):
+    """Forgets the users whose tokens were revoked or permissions changed, called by the auth service"""
+    principal_cache.evict_users(user_ids)
+    token_revocations.expire()
+
+
+def verify_token(authorization: Optional[str]) -> Optional[TokenUser]:
+    """User of a `Bearer <access token>` header, None when the token is invalid, expired or revoked"""
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme != 'Bearer':
+        return None
+    try:
+        payload = jwt.decode(token, JWT_SIGNING_KEY, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+    # Tokens issued before the permissions claim was added are rejected, their users log in again
+    if payload.get('token_type') != 'access' or 'permissions' not in payload or 'iat' not in payload:
+        return None
+    revoked_before = token_revocations.revoked_before(payload['user_id'])
+    if revoked_before is None or payload['iat'] < revoked_before:
+        return None
+    return TokenUser(id=payload['user_id'], permissions=payload['permissions'])
+
+
+def introspect_token(authorization: Optional[str]) -> Optional[TokenUser]:
+    """User of the Authorization header resolved by the auth service, at most one call per token and TTL"""
+    if not authorization:
+        return None
+    if user := principal_cache.get(authorization):
+        return user
+    try:
+        response = requests.get(url=f'{AUTH_API_URL}/users/introspect/', headers={'Authorization': authorization},
+                                timeout=INTROSPECTION_TIMEOUT_SEC)
+    except requests.RequestException:
+        logger.warning('Token introspection failed, the request is not authenticated', exc_info=True)
+        return None
+    if response.status_code != 200:
+        return None
+    user = TokenUser(**response.json())
+    principal_cache.set(authorization, user)
     return user
 
 
+def get_request_user(headers: Dict[str, str]) -> Optional[TokenUser]:
+    if AUTH_VERIFICATION == 'remote':
+        return introspect_token(headers.get('Authorization'))
+    return verify_token(headers.get('Authorization'))
+
+
+def auth_user(headers: Dict[str, str]) -> bool:
+    if os.environ.get('DEBUG') == 'True':
+        return True
+    return get_request_user(headers) is not None
+
+
 def has_permission(headers: Dict[str, str], permission_name: str) -> bool:
     if os.environ.get('DEBUG') == 'True':
         return True
     user = get_request_user(headers)
-    if permission_name not in user.permissions:
+    if not user or permission_name not in user.permissions:
         return False
     return True
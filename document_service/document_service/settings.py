@@ -13,6 +13,8 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.conn
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -36,6 +38,21 @@ SERVER_API_KEY = os.environ.get('SERVER_API_KEY', '123')
 AUTH_SERVICE_HOST = os.environ.get('AUTH_SERVICE_HOST', '127.0.0.1')
 AUTH_SERVICE_PORT = os.environ.get('AUTH_SERVICE_PORT', '8001')
 
+# Access tokens of the auth service are verified locally with the key it signs them with
+JWT_SIGNING_KEY = os.environ.get('JWT_SIGNING_KEY')
+if not JWT_SIGNING_KEY:
+    raise ImproperlyConfigured('JWT_SIGNING_KEY is not set, access tokens can not be verified with a public default')
+JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+TOKEN_REVOCATIONS_SYNC_SEC = float(os.environ.get('TOKEN_REVOCATIONS_SYNC_SEC', 5))
+# Tokens are rejected when the revocations could not be synced for that long
+TOKEN_REVOCATIONS_MAX_STALENESS_SEC = float(os.environ.get('TOKEN_REVOCATIONS_MAX_STALENESS_SEC', 60))
+
+# 'remote' resolves the users through /users/introspect/ of the auth service, cached per token
+AUTH_VERIFICATION = os.environ.get('AUTH_VERIFICATION', 'local')
+PRINCIPAL_CACHE_TTL_SEC = float(os.environ.get('PRINCIPAL_CACHE_TTL_SEC', 30))
+INTROSPECTION_TIMEOUT_SEC = float(os.environ.get('INTROSPECTION_TIMEOUT_SEC', 2))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+
 # custom settings end
 
 # Application definition
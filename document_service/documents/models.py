@@ -2,7 +2,7 @@ import enum
 
 from django.db import models
 
-from utils import AbstractCreateUpdateModel
+from utils import AbstractCreateUpdateModel, invalidate_counts_on_change
 
 
 class PermissionSet(enum.Enum):
@@ -56,3 +56,6 @@ class Tariff(AbstractCreateUpdateModel):
     commercial_price = models.DecimalField(null=True, default=None, max_digits=30, decimal_places=2)
     reduced_price = models.DecimalField(null=True, default=None, max_digits=30, decimal_places=2)
     residential_price = models.DecimalField(null=True, default=None, max_digits=30, decimal_places=2)
+
+
+invalidate_counts_on_change(Document, DocumentationPart, SupplyContract, Tariff)
@@ -98,3 +98,7 @@ class ChangeTariffSerializer(DefaultSerializer):
     commercial_price = serializers.DecimalField(required=False, max_digits=20, decimal_places=2)
     reduced_price = serializers.DecimalField(required=False, max_digits=20, decimal_places=2)
     residential_price = serializers.DecimalField(required=False, max_digits=20, decimal_places=2)
+
+
+class EvictPrincipalsSerializer(DefaultSerializer):
+    user_ids = serializers.ListField(child=serializers.IntegerField(), required=True)
@@ -16,4 +16,6 @@ urlpatterns = [
     path('tariffs/', TariffListView.as_view(), name='Get all tariffs'),
     path('tariffs/<int:tariff_id>/', TariffRetrieveView.as_view(), name='Get tariff'),
 
+    path('principals/evict/', EvictPrincipalsView.as_view(), name='Evict cached users'),
+
 ]
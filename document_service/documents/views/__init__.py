@@ -2,3 +2,4 @@ from documents.views.documentation import DocumentationPartListView, Documentati
 from documents.views.documents import DocumentListView, DocumentRetrieveView
 from documents.views.supply_contracts import SupplyContractListView, SupplyContractRetrieveView
 from documents.views.tariffs import TariffListView, TariffRetrieveView
+from documents.views.principals import EvictPrincipalsView
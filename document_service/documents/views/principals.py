@@ -0,0 +1,22 @@
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from auth_api import SERVER_API_KEY, evict_principals
+from documents.serializers import EvictPrincipalsSerializer
+
+
+class EvictPrincipalsView(APIView):
+    """Called by the auth service when the tokens or the permissions of users change"""
+
+    @swagger_auto_schema(request_body=EvictPrincipalsSerializer)
+    def post(self, request: Request, *args, **kwargs):
+        if request.headers.get('Server-Api-Key') != SERVER_API_KEY:
+            return Response(data={'detail': 'Only available to other services'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = EvictPrincipalsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        evict_principals(serializer.validated_data['user_ids'])
+        return Response(status=status.HTTP_200_OK)
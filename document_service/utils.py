@@ -1,8 +1,21 @@
-from typing import Type
-
-from django.db import models
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+import os
+import time
+from functools import reduce
+from typing import Type, List
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, connection
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
 from django.db.models.sql import Query
-from rest_framework import serializers
+from rest_framework import serializers, status
 from rest_framework.request import Request
 from rest_framework.response import Response
 
@@ -25,19 +38,134 @@ class AbstractCreateUpdateModel(models.Model):
     updated = models.DateTimeField(auto_now=True)
 
 
+COUNT_MODES = ['exact', 'estimate', 'cached', 'none']
+
+COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 60))
+
+
+def _count_version_key(db_model: Type['models.Model']) -> str:
+    return f'count_version:{db_model._meta.label}'
+
+
+def invalidate_counts(sender, **kwargs):
+    # Cached counts are keyed by the version of their model, a new version makes all of them unreachable at once.
+    # Bulk update() and delete() don't send signals, their counts expire after COUNT_CACHE_TTL.
+    cache.set(_count_version_key(sender), time.time_ns(), None)
+
+
+def invalidate_counts_on_change(*db_models: Type['models.Model']):
+    """Connects the count invalidation to the saves and deletes of the paginated `db_models`"""
+    for db_model in db_models:
+        post_save.connect(invalidate_counts, sender=db_model)
+        post_delete.connect(invalidate_counts, sender=db_model)
+
+
+def estimate_count(query) -> int:
+    """Row estimate of the postgres planner for `query`, from the table statistics kept up to date by autovacuum"""
+    sql, params = query.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(query, count_mode: str):
+    """Total size of a filtered list in the given mode, cached counts are keyed by the SQL of the query"""
+    if count_mode == 'none':
+        return None
+    if count_mode == 'estimate':
+        return estimate_count(query)
+    if count_mode == 'exact':
+        return query.count()
+
+    version = cache.get_or_set(_count_version_key(query.model), 0, None)
+    sql, params = query.query.sql_with_params()
+    key = f'count:{query.model._meta.label}:{version}:{hashlib.md5(f"{sql}{params}".encode()).hexdigest()}'
+    count = cache.get(key)
+    if count is None:
+        count = query.count()
+        cache.set(key, count, COUNT_CACHE_TTL)
+    return count
+
+
 def make_pagination_serializer(serializer: Type['serializers.Serializer']):
     class PaginationSerializer(DefaultSerializer):
-        total_size = serializers.IntegerField(required=True)
+        total_size = serializers.IntegerField(required=True, allow_null=True)
+        total_size_mode = serializers.ChoiceField(choices=COUNT_MODES, required=True)
         page_number = serializers.IntegerField(required=True)
         page_size = serializers.IntegerField(required=True)
+        next_after = serializers.CharField(required=False, allow_null=True)
         items = serializer(many=True)
 
     return type(f'Pagination{serializer.__name__}', (PaginationSerializer,), dict(PaginationSerializer.__dict__))()
 
 
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder cuts datetimes to milliseconds, the cursor has to match the stored value exactly
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, cls=CursorEncoder).encode()).decode()
+
+
+def decode_cursor(after: str, size: int):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(after.encode()))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) and len(values) == size else None
+
+
+def keyset_ordering(order_by: List[str]) -> List[str]:
+    """The order_by keys with pk appended as a tie breaker, a row is then identified by its key values"""
+    if not any(ordering.lstrip('-') in ('pk', 'id') for ordering in order_by):
+        order_by = order_by + ['-pk' if order_by and order_by[-1].startswith('-') else 'pk']
+    return order_by
+
+
+def nullable_ordering(db_model: Type['models.Model'], order_by: List[str]):
+    """First key of `order_by` that can be NULL, through a nullable field or relation on its path, else None"""
+    for ordering in order_by:
+        model = db_model
+        for field_name in ordering.lstrip('-').split('__'):
+            try:
+                field = model._meta.pk if field_name == 'pk' else model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                break
+            if field.null:
+                return ordering.lstrip('-')
+            if not field.is_relation:
+                break
+            model = field.related_model
+    return None
+
+
+def seek_filter(order_by: List[str], values: list) -> Q:
+    """Rows that come after the row with the key `values` in `order_by`"""
+    clauses = []
+    for index, ordering in enumerate(order_by):
+        previous_keys_equal = [Q(**{previous.lstrip('-'): value}) for previous, value in zip(order_by, values[:index])]
+        lookup = f'{ordering.lstrip("-")}__{"lt" if ordering.startswith("-") else "gt"}'
+        clauses.append(reduce(lambda a, b: a & b, previous_keys_equal, Q(**{lookup: values[index]})))
+    return reduce(lambda a, b: a | b, clauses)
+
+
+def ordering_value(obj, ordering: str):
+    for field_name in ordering.lstrip('-').split('__'):
+        obj = getattr(obj, field_name)
+    return obj
+
+
 def paginate(db_model: Type['models.Model'], serializer: Type['serializers.Serializer'], request: Request,
              query: Query = None, query_params: dict = None):
-    if not query:
+    # Not a truth test, that would evaluate a QuerySet
+    if query is None:
         query = db_model.objects
 
     if query_params is None:
@@ -49,20 +177,43 @@ def paginate(db_model: Type['models.Model'], serializer: Type['serializers.Seria
 
     page_number = int(query_params.pop('page_number', 1))
     page_size = int(query_params.pop('page_size', 10))
+    after = query_params.pop('after', None)
+    count_mode = query_params.pop('count', 'exact')
+    if count_mode not in COUNT_MODES:
+        return Response({'detail': f'count has to be one of {", ".join(COUNT_MODES)}'},
+                        status=status.HTTP_400_BAD_REQUEST)
 
     order_by = query_params.pop('order_by', [])
 
     query = query.filter(**query_params)
+    count = count_rows(query, count_mode)
+
+    next_after = None
+    if after is None:
+        query = query.order_by(*order_by)
+        result_models = query[(page_number - 1) * page_size: page_number * page_size]
+    else:
+        # Cursor mode, seeks past the row of the `after` token instead of using OFFSET
+        order_by = keyset_ordering(order_by)
+        # NULL keys compare to nothing, rows with a NULL key would be skipped by the seek filter
+        if nullable := nullable_ordering(db_model, order_by):
+            return Response({'detail': f'after cursor can not be used with order_by={nullable}, it is nullable'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if after:
+            values = decode_cursor(after, len(order_by))
+            if values is None:
+                return Response({'detail': 'Invalid after cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            query = query.filter(seek_filter(order_by, values))
+        result_models = list(query.order_by(*order_by)[:page_size])
+        if len(result_models) == page_size:
+            next_after = encode_cursor([ordering_value(result_models[-1], ordering) for ordering in order_by])
 
-    query = query.order_by(*order_by)
-
-    count = query.count()
-
-    result_models = query[(page_number - 1) * page_size: page_number * page_size]
     items = [serializer(obj, context={'request': request}).data for obj in result_models]
     return Response(data={
         'total_size': count,
+        'total_size_mode': count_mode,
         'page_number': page_number,
         'page_size': len(items),
+        'next_after': next_after,
         'items': items
     })
@@ -0,0 +1,74 @@
+from decimal import Decimal
+from typing import Type, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, asc, desc, DateTime, Date, Boolean
+from sqlalchemy.sql.elements import Label
+
+from db import Base
+from filters import filter_plan
+
+AGGREGATES = {
+    'count': func.count,
+    'sum': func.sum,
+    'avg': func.avg,
+    'min': func.min,
+    'max': func.max,
+}
+NUMERIC_AGGREGATES = ('sum', 'avg')
+DATE_PRECISIONS = ('minute', 'hour', 'day', 'week', 'month', 'year')
+
+
+def _is_numeric(column) -> bool:
+    try:
+        return not isinstance(column.type, Boolean) and issubclass(column.type.python_type, (int, float, Decimal))
+    except NotImplementedError:
+        return False
+
+
+def parse_group_by(db_model: Type['Base'], group_by: Optional[str]) -> List[Label]:
+    """
+    `group_by=type,creation_date:day` columns of the groups, dates can be truncated to one of DATE_PRECISIONS.
+    Groups are named by their fields.
+    """
+    columns = []
+    for group in [s.strip() for s in group_by.split(',')] if group_by else []:
+        field, _, precision = group.partition(':')
+        column = filter_plan(db_model).column(field)
+        if precision:
+            if not isinstance(column.type, (DateTime, Date)) or precision not in DATE_PRECISIONS:
+                raise HTTPException(detail=f'{field} can not be grouped by "{precision}", only dates can be grouped '
+                                           f'by {", ".join(DATE_PRECISIONS)}', status_code=400)
+            column = func.date_trunc(precision, column)
+        columns.append(column.label(field))
+    return columns
+
+
+def parse_aggregates(db_model: Type['Base'], agg: Optional[str]) -> List[Label]:
+    """`agg=sum:consumption,count:id` aggregates of the groups named like sum_consumption, count:id by default"""
+    aggregates = []
+    for aggregate in [s.strip() for s in agg.split(',')] if agg else ['count:id']:
+        name, _, field = aggregate.partition(':')
+        if name not in AGGREGATES:
+            raise HTTPException(detail=f'Unknown aggregate "{name}", it has to be one of {", ".join(AGGREGATES)}',
+                                status_code=400)
+        column = filter_plan(db_model).column(field)
+        if name in NUMERIC_AGGREGATES and not _is_numeric(column):
+            raise HTTPException(detail=f'{name} can only aggregate numeric fields', status_code=400)
+        aggregates.append(AGGREGATES[name](column).label(f'{name}_{field}'))
+    return aggregates
+
+
+def parse_aggregate_ordering(group_by: List[Label], aggregates: List[Label], order_by: Optional[str]):
+    """Ordering of the groups by their fields or aggregates, groups are ordered by all their fields by default"""
+    if not order_by:
+        return [asc(column) for column in group_by]
+    labels = {column.name: column for column in group_by + aggregates}
+    ordering = []
+    for name in [s.strip() for s in order_by.split(',')]:
+        if name.lstrip('-') not in labels:
+            raise HTTPException(detail=f'order_by has to be one of the groups or aggregates: {", ".join(labels)}',
+                                status_code=400)
+        column = labels[name.lstrip('-')]
+        ordering.append(desc(column) if name.startswith('-') else asc(column))
+    return ordering
@@ -0,0 +1,142 @@
+"""partitioned_snapshots
+
+Revision ID: 9e4b2d7c1a68
+Revises: 5c1f7e2a9d3b
+Create Date: 2026-10-18 11:30:41.902117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '9e4b2d7c1a68'
+down_revision = '5c1f7e2a9d3b'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def _meter_snapshots_columns(primary_key):
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('meter_snapshots_id_seq'::regclass)"),
+                  autoincrement=False, nullable=False),
+        sa.Column('meter_id', sa.Integer(), nullable=False),
+        sa.Column('type', postgresql.ENUM('Water', 'Gas', 'Heat', 'Electricity', name='metertype', create_type=False),
+                  nullable=False),
+        sa.Column('consumption', sa.Numeric(), nullable=False),
+        sa.Column('automatic', sa.Boolean(), nullable=False),
+        sa.Column('creation_date', sa.DateTime(), nullable='creation_date' not in primary_key),
+        sa.Column('current_time', sa.DateTime(), nullable=True),
+        sa.Column('uptime', sa.Numeric(), nullable=True),
+        sa.ForeignKeyConstraint(['meter_id'], ['meters.id'], name='meter_snapshots_meter_id_fkey',
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(*primary_key, name='meter_snapshots_pkey'),
+    ]
+
+
+def _environmental_readings_columns(primary_key):
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('environmental_readings_id_seq'::regclass)"),
+                  autoincrement=False, nullable=False),
+        sa.Column('room_id', sa.Integer(), nullable=False),
+        sa.Column('automatic', sa.Boolean(), nullable=True),
+        sa.Column('current_time', sa.DateTime(), nullable=False),
+        sa.Column('temperature', sa.Numeric(), nullable=True),
+        sa.Column('humidity', sa.Numeric(), nullable=True),
+        sa.Column('notes', sa.String(length=255), nullable=True),
+        sa.ForeignKeyConstraint(['room_id'], ['rooms.id'], name='environmental_readings_room_id_fkey',
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(*primary_key, name='environmental_readings_pkey'),
+    ]
+
+
+def _rename_table(table_name, new_name, constraints):
+    op.rename_table(table_name, new_name)
+    for constraint in constraints:
+        op.execute(f'ALTER TABLE {new_name} RENAME CONSTRAINT {table_name}_{constraint} TO {new_name}_{constraint}')
+
+
+def _create_monthly_partitions(table_name, column):
+    # Same naming as partitions.partition_name, from the oldest existing row up to MONTHS_AHEAD months from now
+    op.execute(f"""
+        DO $$
+        DECLARE month date;
+        BEGIN
+            FOR month IN SELECT generate_series(
+                date_trunc('month', coalesce((SELECT min("{column}") FROM {table_name}_unpartitioned), now())),
+                date_trunc('month', now()) + interval '{MONTHS_AHEAD} months',
+                interval '1 month')::date
+            LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF {table_name} FOR VALUES FROM (%L) TO (%L)',
+                               '{table_name}_' || to_char(month, '"y"YYYY"m"MM'), month, month + interval '1 month');
+            END LOOP;
+        END $$
+    """)
+    op.execute(f'CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT')
+
+
+def _move_rows(table_name, source_table, columns, select_columns=None):
+    op.execute(f'INSERT INTO {table_name} ({", ".join(columns)}) '
+               f'SELECT {", ".join(select_columns or columns)} FROM {source_table}')
+    op.execute(f'ALTER SEQUENCE {table_name}_id_seq OWNED BY {table_name}.id')
+    op.execute(f'DROP TABLE {source_table}')
+
+
+SNAPSHOT_COLUMNS = ['id', 'meter_id', 'type', 'consumption', 'automatic', 'creation_date', '"current_time"', 'uptime']
+READING_COLUMNS = ['id', 'room_id', 'automatic', '"current_time"', 'temperature', 'humidity', 'notes']
+
+
+def upgrade():
+    op.drop_constraint('heat_meter_snapshots_snapshot_id_fkey', 'heat_meter_snapshots', type_='foreignkey')
+    op.drop_constraint('electricity_meter_snapshots_snapshot_id_fkey', 'electricity_meter_snapshots',
+                       type_='foreignkey')
+
+    _rename_table('meter_snapshots', 'meter_snapshots_unpartitioned', ['pkey', 'meter_id_fkey'])
+    op.create_table('meter_snapshots', *_meter_snapshots_columns(['id', 'creation_date']),
+                    postgresql_partition_by='RANGE (creation_date)')
+    _create_monthly_partitions('meter_snapshots', 'creation_date')
+    _move_rows('meter_snapshots', 'meter_snapshots_unpartitioned', SNAPSHOT_COLUMNS,
+               [c if c != 'creation_date' else "coalesce(creation_date, timezone('utc', now()))"
+                for c in SNAPSHOT_COLUMNS])
+
+    # Replaces ON DELETE CASCADE of the dropped foreign keys. A row moved to another partition by an UPDATE
+    # is deleted and inserted again, its child rows are kept in that case.
+    op.execute("""
+        CREATE FUNCTION meter_snapshots_delete_children() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('metrics.moving_partition_rows', true) = 'on'
+                    OR EXISTS (SELECT 1 FROM meter_snapshots WHERE id = OLD.id) THEN
+                RETURN NULL;
+            END IF;
+            DELETE FROM heat_meter_snapshots WHERE snapshot_id = OLD.id;
+            DELETE FROM electricity_meter_snapshots WHERE snapshot_id = OLD.id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute('CREATE TRIGGER meter_snapshots_delete_children AFTER DELETE ON meter_snapshots '
+               'FOR EACH ROW EXECUTE FUNCTION meter_snapshots_delete_children()')
+
+    _rename_table('environmental_readings', 'environmental_readings_unpartitioned', ['pkey', 'room_id_fkey'])
+    op.create_table('environmental_readings', *_environmental_readings_columns(['id', 'current_time']),
+                    postgresql_partition_by='RANGE ("current_time")')
+    _create_monthly_partitions('environmental_readings', 'current_time')
+    _move_rows('environmental_readings', 'environmental_readings_unpartitioned', READING_COLUMNS)
+
+
+def downgrade():
+    _rename_table('environmental_readings', 'environmental_readings_partitioned', ['pkey', 'room_id_fkey'])
+    op.create_table('environmental_readings', *_environmental_readings_columns(['id']))
+    _move_rows('environmental_readings', 'environmental_readings_partitioned', READING_COLUMNS)
+
+    _rename_table('meter_snapshots', 'meter_snapshots_partitioned', ['pkey', 'meter_id_fkey'])
+    op.create_table('meter_snapshots', *_meter_snapshots_columns(['id']))
+    _move_rows('meter_snapshots', 'meter_snapshots_partitioned', SNAPSHOT_COLUMNS)
+    op.execute('DROP FUNCTION meter_snapshots_delete_children()')
+
+    op.create_foreign_key('electricity_meter_snapshots_snapshot_id_fkey', 'electricity_meter_snapshots',
+                          'meter_snapshots', ['snapshot_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('heat_meter_snapshots_snapshot_id_fkey', 'heat_meter_snapshots',
+                          'meter_snapshots', ['snapshot_id'], ['id'], ondelete='CASCADE')
@@ -0,0 +1,88 @@
+"""time_series_indexes
+
+Revision ID: 7b2e9c4f1d05
+Revises: 3a7d5f0c8e21
+Create Date: 2026-10-18 15:00:36.204519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e9c4f1d05'
+down_revision = '3a7d5f0c8e21'
+branch_labels = None
+depends_on = None
+
+# name, partitioned table, index method, columns
+PARTITIONED_INDEXES = [
+    # Descending like the latest snapshots window of Meter.latest_snapshots, time ranges of one meter use it both ways
+    ('ix_meter_snapshots_meter_id_creation_date', 'meter_snapshots', 'btree', 'meter_id, creation_date DESC, id DESC'),
+    ('ix_meter_snapshots_creation_date_brin', 'meter_snapshots', 'brin', 'creation_date'),
+    ('ix_environmental_readings_room_id_current_time', 'environmental_readings', 'btree', 'room_id, "current_time"'),
+    ('ix_environmental_readings_current_time_brin', 'environmental_readings', 'brin', '"current_time"'),
+]
+
+FOREIGN_KEY_INDEXES = [
+    ('buildings', 'location_id'),
+    ('buildings', 'building_type_id'),
+    ('responsible_users', 'building_id'),
+    ('meters', 'building_id'),
+    ('floors', 'building_id'),
+    ('floor_items', 'floor_id'),
+    ('rooms', 'floor_id'),
+    ('windows', 'room_id'),
+    ('heating_batteries', 'room_id'),
+    ('water_equipment', 'room_id'),
+    ('electric_equipment', 'room_id'),
+]
+
+
+def _partitions(table_name):
+    return [name for name, in op.get_bind().execute(
+        sa.text('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = CAST(:table_name AS regclass) ORDER BY c.relname'),
+        {'table_name': table_name})]
+
+
+def _drop_invalid_index(name):
+    # Left behind by an interrupted CREATE INDEX CONCURRENTLY
+    if op.get_bind().execute(sa.text('SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'),
+                             {'name': name}).scalar():
+        op.execute(f'DROP INDEX CONCURRENTLY {name}')
+
+
+def _create_partitioned_index(name, table_name, method, columns):
+    """
+    CREATE INDEX CONCURRENTLY is not possible on a partitioned table. The index is created on the parent only
+    and stays invalid until an index built concurrently on every partition is attached to it. Partitions created
+    later get the index with ATTACH PARTITION.
+    """
+    op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON ONLY {table_name} USING {method} ({columns})')
+    for partition in _partitions(table_name):
+        partition_index = f'{partition}_{name[len(f"ix_{table_name}_"):]}'
+        _drop_invalid_index(partition_index)
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} '
+                   f'USING {method} ({columns})')
+        op.execute(f'ALTER INDEX {name} ATTACH PARTITION {partition_index}')
+
+
+def upgrade():
+    # Built without locking writes so that the migration can run against a live database
+    with op.get_context().autocommit_block():
+        for name, table_name, method, columns in PARTITIONED_INDEXES:
+            _create_partitioned_index(name, table_name, method, columns)
+        for table_name, column in FOREIGN_KEY_INDEXES:
+            name = f'ix_{table_name}_{column}'
+            _drop_invalid_index(name)
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table_name} ({column})')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table_name, column in FOREIGN_KEY_INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS ix_{table_name}_{column}')
+        for name, _, _, _ in PARTITIONED_INDEXES:
+            # Drops the indexes of the partitions too, a partitioned index can't be dropped concurrently
+            op.execute(f'DROP INDEX IF EXISTS {name}')
@@ -1,33 +1,342 @@
+import hashlib
+import logging
 import os
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
 from os import environ
-from typing import Dict
+from typing import Dict, List, Optional, Iterable, Tuple
 
+import jwt
 import requests
+from pydantic import BaseModel
+from pydantic.datetime_parse import parse_datetime
+from sqlalchemy.orm import Session
 
+from notifications import notify
 from request_models.location_requests import UserModel
 
+logger = logging.getLogger(__name__)
+
 AUTH_API_HOST = environ.get('AUTH_API_HOST', 'localhost')
 AUTH_API_PORT = environ.get('AUTH_API_PORT', '8001')
 AUTH_API_URL = f'http://{AUTH_API_HOST}:{AUTH_API_PORT}'
 
 SERVER_API_KEY = os.environ.get('SERVER_API_KEY', '123')
+# Ids per request of get_users, keeps the query string short
+USERS_BATCH_SIZE = int(environ.get('USERS_BATCH_SIZE', 200))
+USERS_TIMEOUT_SEC = float(environ.get('USERS_TIMEOUT_SEC', 2))
+USER_DIRECTORY_TTL_SEC = float(environ.get('USER_DIRECTORY_TTL_SEC', 300))
+USER_DIRECTORY_SIZE = int(environ.get('USER_DIRECTORY_SIZE', 10000))
+
+# Access tokens of the auth service are verified locally with the key it signs them with
+JWT_SIGNING_KEY = environ.get('JWT_SIGNING_KEY')
+if not JWT_SIGNING_KEY:
+    raise RuntimeError('JWT_SIGNING_KEY is not set, access tokens can not be verified with a public default')
+JWT_ALGORITHM = environ.get('JWT_ALGORITHM', 'HS256')
+TOKEN_REVOCATIONS_SYNC_SEC = float(environ.get('TOKEN_REVOCATIONS_SYNC_SEC', 5))
+# Tokens are rejected when the revocations could not be synced for that long
+TOKEN_REVOCATIONS_MAX_STALENESS_SEC = float(environ.get('TOKEN_REVOCATIONS_MAX_STALENESS_SEC', 60))
+# Revocations committed while the previous sync was running are fetched again by the next one
+TOKEN_REVOCATIONS_OVERLAP = timedelta(seconds=60)
+
+# 'remote' resolves the users through /users/introspect/ of the auth service, cached per token
+AUTH_VERIFICATION = environ.get('AUTH_VERIFICATION', 'local')
+PRINCIPAL_CACHE_TTL_SEC = float(environ.get('PRINCIPAL_CACHE_TTL_SEC', 30))
+INTROSPECTION_TIMEOUT_SEC = float(environ.get('INTROSPECTION_TIMEOUT_SEC', 2))
+PRINCIPAL_CACHE_SIZE = int(environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+# Evictions received by one worker are announced to all of them on this channel
+PRINCIPALS_CHANNEL = 'principals'
+# User ids per notification, payloads are limited to 8000 bytes
+PRINCIPALS_NOTIFICATION_SIZE = 500
+
+
+class TokenUser(BaseModel):
+    id: int
+    permissions: List[str]
+
+
+class TokenRevocations:
+    """
+    Copy of the token revocations of the auth service: user id -> time before which its access tokens are revoked.
+    A background thread, started by the first request, syncs the changes since the previous sync every
+    `sync_interval` seconds, or right away when the auth service announces a revocation. Requests never wait for a
+    sync except the first ones of the process. When no sync succeeded for `max_staleness` seconds the copy can't be
+    trusted, tokens are rejected until the auth service is reachable again.
+    """
+
+    def __init__(self, sync_interval: float, max_staleness: float):
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self._revoked_before = {}
+        self._since = None
+        self._synced = None
+        self._first_sync = threading.Event()
+        self._wake_up = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='token-revocations', daemon=True)
+                self._thread.start()
+
+    def expire(self):
+        """Syncs without waiting for the interval, called when the auth service announces a revocation"""
+        self._wake_up.set()
+
+    def is_stale(self) -> bool:
+        return self._synced is None or time.monotonic() - self._synced > self.max_staleness
+
+    def revoked_before(self, user_id: int) -> Optional[float]:
+        """Time before which the access tokens of the user are revoked, None while the copy is stale"""
+        self.start()
+        self._first_sync.wait(self.sync_interval)
+        if self.is_stale():
+            return None
+        return self._revoked_before.get(user_id, 0)
+
+    def _run(self):
+        while True:
+            self._wake_up.clear()
+            self._sync()
+            self._first_sync.set()
+            self._wake_up.wait(self.sync_interval)
+
+    def _sync(self):
+        started = time.monotonic()
+        try:
+            response = requests.get(url=f'{AUTH_API_URL}/users/token-revocations/',
+                                    params={'since': self._since.isoformat()} if self._since else None,
+                                    headers={'Server-Api-Key': SERVER_API_KEY}, timeout=self.sync_interval)
+            response.raise_for_status()
+            data = response.json()
+            for revocation in data['items']:
+                self._revoked_before[revocation['user_id']] = parse_datetime(revocation['revoked_before']).timestamp()
+            self._since = parse_datetime(data['synced_at']) - TOKEN_REVOCATIONS_OVERLAP
+            self._synced = started
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            if self.is_stale():
+                logger.error('Token revocations are stale, access tokens are rejected until a sync succeeds',
+                             exc_info=True)
+            else:
+                logger.warning('Token revocations sync failed, revoked tokens may be accepted', exc_info=True)
+
+
+token_revocations = TokenRevocations(sync_interval=TOKEN_REVOCATIONS_SYNC_SEC,
+                                     max_staleness=TOKEN_REVOCATIONS_MAX_STALENESS_SEC)
+
+
+class PrincipalCache:
+    """
+    Users resolved by the auth service, keyed by a hash of the Authorization header so that tokens are not kept
+    in memory. Entries live `ttl` seconds, the least recently used are dropped above `max_size`, and all entries
+    of a user are evicted as soon as the auth service announces that its tokens or permissions changed.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._principals = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(authorization: str) -> str:
+        return hashlib.sha256(authorization.encode()).hexdigest()
+
+    def get(self, authorization: str) -> Optional[TokenUser]:
+        key = self.key(authorization)
+        with self._lock:
+            if entry := self._principals.get(key):
+                user, expires = entry
+                if time.monotonic() < expires:
+                    self._principals.move_to_end(key)
+                    return user
+                del self._principals[key]
+        return None
+
+    def set(self, authorization: str, user: TokenUser):
+        key = self.key(authorization)
+        with self._lock:
+            self._principals[key] = (user, time.monotonic() + self.ttl)
+            self._principals.move_to_end(key)
+            while len(self._principals) > self.max_size:
+                self._principals.popitem(last=False)
+
+    def evict_users(self, user_ids: Iterable[int]):
+        user_ids = set(user_ids)
+        with self._lock:
+            for key in [key for key, (user, _) in self._principals.items() if user.id in user_ids]:
+                del self._principals[key]
+
+    def clear(self):
+        with self._lock:
+            self._principals.clear()
+
+
+principal_cache = PrincipalCache(ttl=PRINCIPAL_CACHE_TTL_SEC, max_size=PRINCIPAL_CACHE_SIZE)
+
+
+class UserDirectory:
+    """
+    Users of the auth service by id, filled by get_users. Entries are fresh for `ttl` seconds and fetched again
+    after that, but stale ones are still served while the auth service is unavailable. The least recently used
+    are dropped above `max_size`, and users are evicted as soon as the auth service announces that they changed.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, user_ids: Iterable[int]) -> Tuple[Dict[int, UserModel], List[int]]:
+        """Known users, fresh or stale, and the ids that have to be fetched"""
+        users, outdated = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                if entry := self._users.get(user_id):
+                    users[user_id], fetched = entry
+                    self._users.move_to_end(user_id)
+                    if now - fetched < self.ttl:
+                        continue
+                outdated.append(user_id)
+        return users, outdated
+
+    def store(self, users: Dict[int, UserModel]):
+        now = time.monotonic()
+        with self._lock:
+            for user_id, user in users.items():
+                self._users[user_id] = (user, now)
+                self._users.move_to_end(user_id)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
 
+    def evict(self, user_ids: Iterable[int]):
+        with self._lock:
+            for user_id in user_ids:
+                self._users.pop(user_id, None)
 
-def get_user(user_id: int) -> UserModel:
-    response = requests.get(url=f'{AUTH_API_URL}/users/{user_id}/', headers={'Server-Api-Key': SERVER_API_KEY})
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_directory = UserDirectory(ttl=USER_DIRECTORY_TTL_SEC, max_size=USER_DIRECTORY_SIZE)
+
+
+def evict_principals(user_ids: Iterable[int]):
+    """Forgets the users whose tokens, permissions or profiles changed in this worker"""
+    user_ids = list(user_ids)
+    principal_cache.evict_users(user_ids)
+    user_directory.evict(user_ids)
+    token_revocations.expire()
+
+
+def announce_evictions(db: Session, user_ids: List[int]):
+    """Makes every worker forget the users, called by the auth service. Sent when the transaction commits"""
+    for start in range(0, len(user_ids), PRINCIPALS_NOTIFICATION_SIZE):
+        notify(db, PRINCIPALS_CHANNEL, ','.join(map(str, user_ids[start:start + PRINCIPALS_NOTIFICATION_SIZE])))
+
+
+def on_evictions(payload: str):
+    evict_principals(int(user_id) for user_id in payload.split(','))
+
+
+def forget_all_principals():
+    principal_cache.clear()
+    user_directory.clear()
+    token_revocations.expire()
+
+
+def get_user(user_id: int) -> Optional[UserModel]:
+    """User of the auth service, None if it does not exist, requests.RequestException if it can't be reached"""
+    response = requests.get(url=f'{AUTH_API_URL}/users/{user_id}/', headers={'Server-Api-Key': SERVER_API_KEY},
+                            timeout=USERS_TIMEOUT_SEC)
     if response.status_code == 404:
         return None
+    response.raise_for_status()
     user = UserModel(**response.json())
     return user
 
 
-def auth_user(headers: Dict[str, str]) -> UserModel:
+def _fetch_users(user_ids: List[int]) -> Dict[int, UserModel]:
+    users = {}
+    for start in range(0, len(user_ids), USERS_BATCH_SIZE):
+        batch = user_ids[start:start + USERS_BATCH_SIZE]
+        response = requests.get(url=f'{AUTH_API_URL}/users/',
+                                params={'ids': ','.join(map(str, batch)), 'page_size': len(batch), 'count': 'none'},
+                                headers={'Server-Api-Key': SERVER_API_KEY}, timeout=USERS_TIMEOUT_SEC)
+        response.raise_for_status()
+        users.update({user['id']: UserModel(**user) for user in response.json()['items']})
+    return users
+
+
+def get_users(user_ids: Iterable[int]) -> Dict[int, UserModel]:
+    """
+    Users by id from the user directory, the missing and outdated ones are fetched in one call per USERS_BATCH_SIZE
+    ids. Unknown users are left out, and so are uncached users while the auth service is unavailable.
+    """
+    # user_id of a responsible user is nullable, there is no user to resolve then
+    users, outdated = user_directory.lookup(sorted({user_id for user_id in user_ids if user_id is not None}))
+    if not outdated:
+        return users
+    try:
+        fetched = _fetch_users(outdated)
+    except (requests.RequestException, ValueError):
+        logger.warning('Users could not be fetched, serving %s cached users', len(users), exc_info=True)
+        return users
+    # Outdated users that were not fetched again were deleted
+    user_directory.evict(outdated)
+    user_directory.store(fetched)
+    for user_id in outdated:
+        users.pop(user_id, None)
+    return {**users, **fetched}
+
+
+def verify_token(authorization: Optional[str]) -> Optional[TokenUser]:
+    """User of a `Bearer <access token>` header, None when the token is invalid, expired or revoked"""
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme != 'Bearer':
+        return None
+    try:
+        payload = jwt.decode(token, JWT_SIGNING_KEY, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+    # Tokens issued before the permissions claim was added are rejected, their users log in again
+    if payload.get('token_type') != 'access' or 'permissions' not in payload or 'iat' not in payload:
+        return None
+    revoked_before = token_revocations.revoked_before(payload['user_id'])
+    if revoked_before is None or payload['iat'] < revoked_before:
+        return None
+    return TokenUser(id=payload['user_id'], permissions=payload['permissions'])
+
+
+def introspect_token(authorization: Optional[str]) -> Optional[TokenUser]:
+    """User of the Authorization header resolved by the auth service, at most one call per token and TTL"""
+    if not authorization:
+        return None
+    if user := principal_cache.get(authorization):
+        return user
+    try:
+        response = requests.get(url=f'{AUTH_API_URL}/users/introspect/', headers={'Authorization': authorization},
+                                timeout=INTROSPECTION_TIMEOUT_SEC)
+    except requests.RequestException:
+        logger.warning('Token introspection failed, the request is not authenticated', exc_info=True)
+        return None
+    if response.status_code != 200:
+        return None
+    user = TokenUser(**response.json())
+    principal_cache.set(authorization, user)
+    return user
+
+
+def auth_user(headers: Dict[str, str]) -> Optional[TokenUser]:
     if os.environ.get('DEBUG') == 'True':
         return True
-    response = requests.get(url=f'{AUTH_API_URL}/users/auth-user/',
-                            headers={k.capitalize(): v for k, v in headers.items()})
-    if response.status_code == 404:
-        return False
-    user = UserModel(**response.json())
-    return user
+    if AUTH_VERIFICATION == 'remote':
+        return introspect_token(headers.get('authorization'))
+    return verify_token(headers.get('authorization'))
@@ -0,0 +1,47 @@
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SERVER_API_KEY = os.environ.get('SERVER_API_KEY', '123')
+
+
+def _fetch(session: requests.Session, url: str, headers: dict, timeout: float):
+    started = time.perf_counter()
+    try:
+        ok = session.get(url, headers=headers, timeout=timeout).status_code == 200
+    except requests.RequestException:
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run(url: str, concurrency: int, total_requests: int, headers: dict, timeout: float):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: _fetch(session, url, headers, timeout), range(total_requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    failed = sum(1 for _, ok in results if not ok)
+    print(f'{total_requests} requests, concurrency {concurrency}: {(total_requests - failed) / elapsed:.1f} req/s, '
+          f'{failed} failed')
+    print(f'latency p50 {statistics.median(latencies) * 1000:.1f} ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent GET throughput against a running metrics service')
+    parser.add_argument('url', nargs='?', default='http://localhost:8002/metrics/meters/')
+    parser.add_argument('-c', '--concurrency', type=int, default=32)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-t', '--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    run(args.url, args.concurrency, args.requests, {'Server-Api-Key': SERVER_API_KEY}, args.timeout)
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries expire `ttl` seconds after they were set.
+
+    Entries can be discarded by value. A value read from the database before it was discarded is stale, so `set`
+    takes the `generation()` taken before the read and drops values discarded since. The generations of the last
+    `max_size` discarded values are kept, reads older than the ones forgotten are dropped whatever their value.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._keys_by_value = {}
+        self._generation = 0
+        self._discarded_at = OrderedDict()
+        self._forgotten_before = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def generation(self) -> int:
+        """Taken before reading a value that is passed to `set` afterwards"""
+        return self._generation
+
+    def set(self, key: Hashable, value: Any, read_at: Optional[int] = None):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if read_at is not None and (read_at < self._forgotten_before
+                                        or read_at < self._discarded_at.get(value, -1)):
+                return
+            self._remove(key)
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._keys_by_value.setdefault(value, set()).add(key)
+            while len(self._items) > self.max_size:
+                self._remove(next(iter(self._items)))
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+
+    def discard_value(self, value: Any):
+        with self._lock:
+            self._generation += 1
+            self._discarded_at[value] = self._generation
+            self._discarded_at.move_to_end(value)
+            while len(self._discarded_at) > self.max_size:
+                _, self._forgotten_before = self._discarded_at.popitem(last=False)
+            for key in self._keys_by_value.pop(value, ()):
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._forgotten_before = self._generation
+            self._discarded_at.clear()
+            self._items.clear()
+            self._keys_by_value.clear()
+
+    def _remove(self, key: Hashable):
+        item = self._items.pop(key, None)
+        if item is not None:
+            keys = self._keys_by_value[item[0]]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_value[item[0]]
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,12 @@
+"""
+The tests write to the database named by TEST_POSTGRES_DB on the POSTGRES_HOST server, inside a transaction that is
+rolled back. They are skipped when it is not set, so that they never run against the database of the service.
+"""
+import os
+
+TEST_POSTGRES_DB = os.environ.get('TEST_POSTGRES_DB')
+
+if TEST_POSTGRES_DB:
+    # Read when db and auth_api are imported, which the test modules do after this
+    os.environ['POSTGRES_DB'] = TEST_POSTGRES_DB
+    os.environ.setdefault('JWT_SIGNING_KEY', 'test-signing-key')
@@ -0,0 +1,95 @@
+import enum
+import json
+import threading
+from collections import defaultdict
+from os import environ
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.expression import ClauseElement
+
+from cache import TTLCache
+from db import engine
+
+COUNT_CACHE_SIZE = int(environ.get('COUNT_CACHE_SIZE', 1000))
+COUNT_CACHE_TTL = int(environ.get('COUNT_CACHE_TTL', 60))
+
+
+class CountMode(str, enum.Enum):
+    exact = 'exact'
+    estimate = 'estimate'
+    cached = 'cached'
+    none = 'none'
+
+
+cached_counts = TTLCache(max_size=COUNT_CACHE_SIZE, ttl=COUNT_CACHE_TTL)
+
+# Bumped on every write to a table, cached counts are keyed by the version of their table so a write makes
+# all of them unreachable at once. Stale entries are dropped by the LRU.
+_table_versions = defaultdict(int)
+_versions_lock = threading.Lock()
+
+
+def invalidate_counts(table_name: str):
+    with _versions_lock:
+        _table_versions[table_name] += 1
+
+
+class Explain(Executable, ClauseElement):
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return f'EXPLAIN (FORMAT JSON) {compiler.process(element.statement, **kw)}'
+
+
+def estimate_count(query: Query) -> int:
+    """Row estimate of the planner for `query`, from the table statistics kept up to date by autovacuum"""
+    plan = query.session.execute(Explain(query.statement)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(query: Query, table_name: str, mode: CountMode) -> Optional[int]:
+    """Total size of a filtered list in the given mode, cached counts are keyed by the SQL of the query"""
+    if mode == CountMode.none:
+        return None
+    if mode == CountMode.estimate:
+        return estimate_count(query)
+    if mode == CountMode.exact:
+        return query.count()
+
+    statement = query.statement.compile(dialect=engine.dialect)
+    key = (table_name, _table_versions[table_name], str(statement), repr(sorted(statement.params.items())))
+    count = cached_counts.get(key)
+    if count is None:
+        count = query.count()
+        cached_counts.set(key, count)
+    return count
+
+
+@event.listens_for(engine, 'after_execute')
+def _invalidate_written_table(connection, clauseelement, multiparams, params, result):
+    if isinstance(clauseelement, UpdateBase):
+        table_name = clauseelement.table.name
+        invalidate_counts(table_name)
+        connection.info.setdefault('written_tables', set()).add(table_name)
+
+
+@event.listens_for(engine, 'commit')
+def _invalidate_committed_tables(connection):
+    # A count cached by another session between the write and the commit still saw the old rows
+    for table_name in connection.info.pop('written_tables', ()):
+        invalidate_counts(table_name)
+
+
+@event.listens_for(engine, 'rollback')
+def _forget_written_tables(connection):
+    connection.info.pop('written_tables', None)
@@ -9,9 +9,12 @@ db_password = environ.get('POSTGRES_PASSWORD', '')
 db_name = environ.get('POSTGRES_DB', '')
 db_host = environ.get('POSTGRES_HOST', '')
 
+db_pool_size = int(environ.get('POSTGRES_POOL_SIZE', 20))
+db_max_overflow = int(environ.get('POSTGRES_MAX_OVERFLOW', 20))
+
 SQLALCHEMY_DATABASE_URL = f"postgresql://{db_user}:{db_password}@{db_host}/{db_name}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=db_pool_size, max_overflow=db_max_overflow)
 
 db = sessionmaker(bind=engine)
 
@@ -24,6 +27,8 @@ Base = declarative_base(cls=Base)
 
 
 def get_db() -> Session:
+    # Routes are plain `def` functions served from the threadpool, so blocking queries never stall the event loop.
+    # So is this dependency, closing the session rolls back and returns its connection to the pool.
     session = db()
     try:
         yield session
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets. Returns the indices of `points` samples of the series `x`, `y` (sorted by `x`),
+    always keeping the first and the last one. Every bucket is handled with array operations, only the walk over
+    buckets is a python loop since each pick depends on the previous one.
+    """
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket == points - 3:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_end = edges[bucket + 2]
+            next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def min_max(y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Splits the series into `points / 2` buckets and returns the indices of the minimum and the maximum
+    of every bucket in series order, so peaks are never dropped.
+    """
+    size = len(y)
+    if points >= size or points < 2:
+        return np.arange(size)
+
+    buckets = np.arange(size) * (points // 2) // size
+    order = np.lexsort((y, buckets))
+    bounds = np.flatnonzero(np.diff(buckets)) + 1
+    starts, ends = np.r_[0, bounds], np.r_[bounds, size]
+    return np.unique(np.concatenate([order[starts], order[ends - 1]]))
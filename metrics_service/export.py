@@ -0,0 +1,71 @@
+import csv
+import enum
+import io
+import json
+from datetime import date
+from decimal import Decimal
+from os import environ
+from typing import Iterator
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy.engine import Connection, ResultProxy
+
+from db import engine
+
+EXPORT_FETCH_SIZE = int(environ.get('EXPORT_FETCH_SIZE', 1000))
+
+
+class ExportFormat(enum.Enum):
+    ndjson = 'ndjson'
+    csv = 'csv'
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def _stream(connection: Connection, result: ResultProxy, export_format: ExportFormat) -> Iterator[str]:
+    try:
+        columns = list(result.keys())
+        if export_format == ExportFormat.csv:
+            yield ','.join(columns) + '\r\n'
+
+        while True:
+            rows = result.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            buffer = io.StringIO()
+            if export_format == ExportFormat.csv:
+                csv.writer(buffer).writerows([_plain(value) for value in row] for row in rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps({column: _plain(value) for column, value in zip(columns, row)}))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+    finally:
+        result.close()
+        connection.close()
+
+
+def export_response(statement, export_format: ExportFormat, filename: str) -> StreamingResponse:
+    """
+    Streams every row of `statement` as NDJSON or CSV. Rows come from a server-side cursor `EXPORT_FETCH_SIZE`
+    at a time, so memory use does not depend on the size of the export. The statement is executed before the
+    response starts, errors in it are still returned as a normal error response.
+    """
+    connection = engine.connect().execution_options(stream_results=True)
+    try:
+        result = connection.execute(statement)
+    except Exception:
+        connection.close()
+        raise
+
+    media_type = 'text/csv' if export_format == ExportFormat.csv else 'application/x-ndjson'
+    headers = {'Content-Disposition': f'attachment; filename="{filename}.{export_format.value}"'}
+    return StreamingResponse(_stream(connection, result, export_format), media_type=media_type, headers=headers)
@@ -0,0 +1,198 @@
+import enum
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import takewhile
+from typing import Type, Dict, List, Callable, Any, Tuple, Optional
+
+from fastapi import HTTPException
+from pydantic.datetime_parse import parse_datetime, parse_date
+from sqlalchemy import inspect, String, Enum
+from sqlalchemy.orm import Query, RelationshipProperty, aliased
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+from db import Base
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in ('true', '1', 'yes'):
+        return True
+    if value.lower() in ('false', '0', 'no'):
+        return False
+    raise ValueError(value)
+
+
+def _parse_decimal(value: str) -> Decimal:
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+
+
+def _parse_datetime(value: str) -> datetime:
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        # A plain date means its midnight, like postgres casts it
+        return datetime.combine(parse_date(value), time())
+
+
+def _enum_parser(enum_class: Type[enum.Enum]) -> Callable[[str], enum.Enum]:
+    def parse(value: str) -> enum.Enum:
+        return enum_class[value] if value in enum_class.__members__ else enum_class(value)
+    return parse
+
+
+def _value_parser(column: InstrumentedAttribute) -> Callable[[str], Any]:
+    """Parser of query string values into the python type of the column, they are bound with the column type"""
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return str
+    if issubclass(python_type, enum.Enum):
+        return _enum_parser(python_type)
+    return {
+        'datetime': _parse_datetime,
+        'date': parse_date,
+        'Decimal': _parse_decimal,
+        'bool': _parse_bool,
+        'int': int,
+        'float': float,
+    }.get(python_type.__name__, str)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+OPERATORS = {
+    'eq': lambda column, value: column == value,
+    'neq': lambda column, value: column != value,
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+    'in': lambda column, values: column.in_(values),
+    'range': lambda column, values: column.between(*values),
+    'isnull': lambda column, value: column.is_(None) if value else column.isnot(None),
+    'icontains': lambda column, value: column.ilike(f'%{_escape_like(value)}%', escape='\\'),
+    'startswith': lambda column, value: column.startswith(value, autoescape=True),
+}
+
+# Operators taking comma separated values, with the number of values they need
+LIST_OPERATORS = {'in': None, 'range': 2}
+TEXT_OPERATORS = ('icontains', 'startswith')
+
+
+class FilterPlan:
+    """
+    Filters of a model compiled from its mapper: `field__operator=value` query params are checked against the
+    columns and their values are parsed into the column types, see filter_plan.
+
+    Fields of related models are reached with relationship paths like `meter__building_id` or
+    `room.floor.building_id`. Many-to-one relationships are outer joined once per path, the planner turns the
+    joins into inner ones as soon as a filter needs the related row. One-to-many relationships are filtered with
+    EXISTS so that the rows of the list aren't repeated.
+    """
+
+    def __init__(self, db_model: Type['Base']):
+        self.db_model = db_model
+        mapper = inspect(db_model)
+        self.columns = {column.key: getattr(db_model, column.key) for column in mapper.column_attrs}
+        self.parsers = {name: _value_parser(column) for name, column in self.columns.items()}
+        self.relationships = {relationship.key: relationship for relationship in mapper.relationships
+                              if not relationship.viewonly}
+
+    def column(self, field: str) -> InstrumentedAttribute:
+        if field not in self.columns:
+            raise HTTPException(detail=f'Unknown field "{field}"', status_code=400)
+        return self.columns[field]
+
+    def parse(self, field: str, operator: str, value: str):
+        if operator == 'isnull':
+            return _parse_bool(value)
+        if operator in TEXT_OPERATORS:
+            return value
+        if operator in LIST_OPERATORS:
+            values = [self.parsers[field](v.strip()) for v in value.split(',')]
+            if LIST_OPERATORS[operator] not in (None, len(values)):
+                raise ValueError(value)
+            return values
+        return self.parsers[field](value)
+
+    def predicate(self, filter_arg: str, value: str, lookup: str = None, entity=None):
+        """Predicate of `lookup` (`field__operator`, defaults to filter_arg) on entity, the model or an alias of it"""
+        field, _, operator = (lookup or filter_arg).partition('__')
+        operator = operator or 'eq'
+        column = self.column(field)
+        if operator not in OPERATORS:
+            raise HTTPException(detail=f'Unknown filter operator "{operator}"', status_code=400)
+        if operator in TEXT_OPERATORS and (not isinstance(column.type, String) or isinstance(column.type, Enum)):
+            raise HTTPException(detail=f'{operator} can only filter text fields', status_code=400)
+        try:
+            value = self.parse(field, operator, value)
+        except (ValueError, TypeError):
+            raise HTTPException(detail=f'Invalid value of {filter_arg}: "{value}"', status_code=400)
+        return OPERATORS[operator](column if entity is None else getattr(entity, field), value)
+
+    def resolve(self, filter_arg: str) -> Tuple[List[RelationshipProperty], 'FilterPlan', str]:
+        """Relationships of the path of filter_arg, the plan of the model it ends at and the lookup left on it"""
+        path = filter_arg.replace('.', '__').split('__')
+        relationships, plan = [], self
+        while len(path) > 1 and path[0] in plan.relationships:
+            relationship = plan.relationships[path.pop(0)]
+            relationships.append(relationship)
+            plan = filter_plan(relationship.mapper.class_)
+        return relationships, plan, '__'.join(path)
+
+    @staticmethod
+    def _skip_join(relationship: RelationshipProperty, plan: 'FilterPlan', lookup: str) -> Optional[str]:
+        """
+        Lookup on the foreign key when a many-to-one path ends at the key it references,
+        `meter__id=5` is `meter_id=5` and uses the index of meter_id without joining meters
+        """
+        field, separator, operator = lookup.partition('__')
+        if field not in plan.columns:
+            return None
+        column = plan.columns[field].property.columns[0]
+        for local, remote in relationship.local_remote_pairs:
+            if remote is column:
+                return relationship.parent.get_property_by_column(local).key + separator + operator
+        return None
+
+    def apply(self, query: Query, query_params: Dict[str, str]) -> Query:
+        joined = {}
+        predicates = []
+        for filter_arg, value in query_params.items():
+            relationships, plan, lookup = self.resolve(filter_arg)
+            joins = list(takewhile(lambda relationship: not relationship.uselist, relationships))
+            nested = relationships[len(joins):]
+            while joins and not nested and (local_lookup := self._skip_join(joins[-1], plan, lookup)):
+                joins.pop()
+                plan, lookup = filter_plan(joins[-1].mapper.class_) if joins else self, local_lookup
+
+            entity = self.db_model
+            for i, relationship in enumerate(joins):
+                path = tuple(join.key for join in joins[:i + 1])
+                if path not in joined:
+                    joined[path] = aliased(relationship.mapper.class_)
+                    query = query.outerjoin(joined[path], getattr(entity, relationship.key))
+                entity = joined[path]
+
+            predicate = plan.predicate(filter_arg, value, lookup, nested[-1].mapper.class_ if nested else entity)
+            for relationship in reversed(nested):
+                owner = entity if relationship is nested[0] else relationship.parent.class_
+                attribute = getattr(owner, relationship.key)
+                predicate = attribute.any(predicate) if relationship.uselist else attribute.has(predicate)
+            predicates.append(predicate)
+        return query.filter(*predicates)
+
+
+@lru_cache(maxsize=None)
+def filter_plan(db_model: Type['Base']) -> FilterPlan:
+    return FilterPlan(db_model)
+
+
+def compile_filter_plans():
+    for db_model in Base.__subclasses__():
+        filter_plan(db_model)
@@ -0,0 +1,196 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple, Union
+
+from sqlalchemy import select
+
+from db import engine
+from ingestion import reserve_ids, SNAPSHOT_COLUMNS, HEAT_COLUMNS, ELECTRICITY_COLUMNS
+from models.metrics import Meter, MeterSnapshot, HeatMeterSnapshot, ElectricityMeterSnapshot, MeterType
+from last_values import update_last_snapshots
+from partitions import ensure_partitions
+from rollups import add_to_rollups
+
+DATE_COLUMNS = ('creation_date', 'current_time')
+NUMERIC_COLUMNS = ('consumption', 'uptime', *HEAT_COLUMNS, *ELECTRICITY_COLUMNS)
+
+
+class RowError(Exception):
+    pass
+
+
+def read_records(path: str, file_format: str) -> Iterator[Union[Dict, RowError]]:
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                # Invalid lines are yielded as errors, so they are reported and stop the import like invalid rows
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield RowError(f'line {line_number} is not valid JSON: {e}')
+                    continue
+                yield record if isinstance(record, dict) else RowError(f'line {line_number} is not a JSON object')
+
+
+def parse_record(record: Union[Dict, RowError], meters: Dict[str, Tuple[int, MeterType]], automatic: bool) -> Dict:
+    if isinstance(record, RowError):
+        raise record
+    serial_number = str(record.get('serial_number') or '')
+    if serial_number not in meters:
+        raise RowError(f'unknown meter serial_number "{serial_number}"')
+    meter_id, meter_type = meters[serial_number]
+
+    snapshot = {'meter_id': meter_id, 'automatic': automatic}
+    try:
+        snapshot['type'] = MeterType[record['type']] if record.get('type') else meter_type
+    except KeyError:
+        raise RowError(f'unknown type "{record["type"]}"')
+
+    for column in NUMERIC_COLUMNS:
+        value = record.get(column)
+        try:
+            snapshot[column] = Decimal(str(value)) if value not in (None, '') else None
+        except InvalidOperation:
+            raise RowError(f'{column} is not a number: "{value}"')
+
+    for column in DATE_COLUMNS:
+        value = record.get(column)
+        try:
+            snapshot[column] = datetime.fromisoformat(value) if value else None
+        except (TypeError, ValueError):
+            raise RowError(f'{column} is not an ISO date: "{value}"')
+        # Stored as naive UTC, the offset of an aware date is applied instead of dropped
+        if snapshot[column] and snapshot[column].tzinfo:
+            snapshot[column] = snapshot[column].astimezone(timezone.utc).replace(tzinfo=None)
+
+    if snapshot['consumption'] is None:
+        raise RowError('consumption is required')
+    if snapshot['creation_date'] is None:
+        raise RowError('creation_date is required')
+    if snapshot['type'] == MeterType.Electricity and snapshot['voltage'] is None:
+        raise RowError('voltage is required for electricity snapshots')
+    return snapshot
+
+
+def _copy(cursor, table_name: str, columns: List[str], rows: List[List]):
+    if not rows:
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([value.name if isinstance(value, MeterType) else value for value in row])
+    buffer.seek(0)
+    quoted_columns = ', '.join(f'"{column}"' for column in columns)
+    cursor.copy_expert(f'COPY {table_name} ({quoted_columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def copy_snapshots(connection, snapshots: List[Dict]):
+    snapshot_ids = reserve_ids(connection, MeterSnapshot.__tablename__, len(snapshots))
+    snapshot_rows, heat_rows, electricity_rows = [], [], []
+    for snapshot_id, snapshot in zip(snapshot_ids, snapshots):
+        snapshot_rows.append([snapshot_id] + [snapshot[column] for column in SNAPSHOT_COLUMNS])
+        if snapshot['type'] == MeterType.Heat:
+            heat_rows.append([snapshot_id] + [snapshot[column] for column in HEAT_COLUMNS])
+        elif snapshot['type'] == MeterType.Electricity:
+            electricity_rows.append([snapshot_id] + [snapshot[column] for column in ELECTRICITY_COLUMNS])
+
+    cursor = connection.connection.cursor()
+    _copy(cursor, MeterSnapshot.__tablename__, ['id'] + SNAPSHOT_COLUMNS, snapshot_rows)
+    _copy(cursor, HeatMeterSnapshot.__tablename__, ['snapshot_id'] + HEAT_COLUMNS, heat_rows)
+    _copy(cursor, ElectricityMeterSnapshot.__tablename__, ['snapshot_id'] + ELECTRICITY_COLUMNS, electricity_rows)
+    add_to_rollups(connection, [(snapshot['meter_id'], snapshot['creation_date'], snapshot['consumption'])
+                                for snapshot in snapshots])
+    update_last_snapshots(connection, [{'id': snapshot_id, **snapshot}
+                                       for snapshot_id, snapshot in zip(snapshot_ids, snapshots)])
+
+
+def read_progress(progress_path: str) -> int:
+    if not os.path.exists(progress_path):
+        return 0
+    with open(progress_path) as file:
+        return json.load(file)['rows']
+
+
+def write_progress(progress_path: str, rows: int):
+    with open(f'{progress_path}.tmp', 'w') as file:
+        json.dump({'rows': rows}, file)
+    os.replace(f'{progress_path}.tmp', progress_path)
+
+
+def import_snapshots(path: str, file_format: str, chunk_size: int, dry_run: bool, automatic: bool,
+                     progress_path: str, max_errors: int) -> int:
+    with engine.connect() as connection:
+        meters = {serial_number: (meter_id, meter_type) for meter_id, serial_number, meter_type in
+                  connection.execute(select([Meter.id, Meter.serial_number, Meter.type]))}
+
+        done = 0 if dry_run else read_progress(progress_path)
+        records = enumerate(read_records(path, file_format), start=1)
+        for _ in islice(records, done):
+            pass
+        if done:
+            print(f'Resuming after {done} rows')
+
+        errors = 0
+        while chunk := list(islice(records, chunk_size)):
+            snapshots = []
+            for line, record in chunk:
+                try:
+                    snapshots.append(parse_record(record, meters, automatic))
+                except RowError as e:
+                    errors += 1
+                    if errors <= max_errors:
+                        print(f'Row {line}: {e}', file=sys.stderr)
+
+            if dry_run:
+                done += len(chunk)
+                continue
+            if errors:
+                print(f'Stopped at row {chunk[0][0]}, {done} rows are imported. '
+                      f'Fix the file and run again to resume.', file=sys.stderr)
+                return 1
+
+            creation_dates = [snapshot['creation_date'] for snapshot in snapshots]
+            ensure_partitions(connection, MeterSnapshot.__tablename__, min(creation_dates), max(creation_dates))
+            with connection.begin():
+                copy_snapshots(connection, snapshots)
+            done += len(chunk)
+            write_progress(progress_path, done)
+            print(f'{done} rows imported')
+
+    if dry_run:
+        print(f'{done} rows checked, {errors} invalid')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk import of historical meter snapshots with COPY. '
+                                                 'Meters are matched by serial_number.')
+    parser.add_argument('path', help='CSV file with a header row, or NDJSON file')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--dry-run', action='store_true', help='only validate the file, nothing is written')
+    parser.add_argument('--automatic', action='store_true', help='mark imported snapshots as automatic')
+    parser.add_argument('--progress-file', help='defaults to <path>.progress')
+    parser.add_argument('--max-errors', type=int, default=100, help='maximum number of invalid rows to print')
+    args = parser.parse_args()
+
+    sys.exit(import_snapshots(
+        path=args.path,
+        file_format=args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv'),
+        chunk_size=args.chunk_size,
+        dry_run=args.dry_run,
+        automatic=args.automatic,
+        progress_path=args.progress_file or f'{args.path}.progress',
+        max_errors=args.max_errors,
+    ))
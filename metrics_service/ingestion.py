@@ -0,0 +1,170 @@
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from os import environ
+from typing import List, Dict
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db import db
+from models.metrics import MeterSnapshot, HeatMeterSnapshot, ElectricityMeterSnapshot, MeterType
+from last_values import update_last_snapshots
+from rollups import add_to_rollups
+
+logger = logging.getLogger(__name__)
+
+INGEST_BUFFER_ENABLED = environ.get('INGEST_BUFFER_ENABLED') == 'True'
+INGEST_BUFFER_MAX_SIZE = int(environ.get('INGEST_BUFFER_MAX_SIZE', 10000))
+INGEST_FLUSH_SIZE = int(environ.get('INGEST_FLUSH_SIZE', 500))
+INGEST_FLUSH_INTERVAL_SEC = float(environ.get('INGEST_FLUSH_INTERVAL_SEC', 1))
+
+SNAPSHOT_COLUMNS = ['meter_id', 'type', 'consumption', 'automatic', 'creation_date', 'current_time', 'uptime']
+HEAT_COLUMNS = [c.name for c in HeatMeterSnapshot.__table__.columns if c.name not in ('id', 'snapshot_id')]
+ELECTRICITY_COLUMNS = [c.name for c in ElectricityMeterSnapshot.__table__.columns if c.name not in ('id', 'snapshot_id')]
+
+
+def reserve_ids(db: Session, table_name: str, amount: int) -> List[int]:
+    result = db.execute(text("SELECT nextval(:sequence) FROM generate_series(1, :amount)"),
+                        {'sequence': f'{table_name}_id_seq', 'amount': amount})
+    return [row[0] for row in result]
+
+
+def _row(source: Dict, columns: List[str]) -> Dict:
+    return {column: source.get(column) for column in columns}
+
+
+def bulk_insert_snapshots(db: Session, snapshots: List[Dict]) -> List[int]:
+    """
+    Inserts snapshot dicts shaped like `AddMeterSnapshotModel.dict()` (plus `meter_id` and `automatic`)
+    with one multi-row INSERT per table, updates the rollups and the last snapshots.
+    Returns the new snapshot ids in input order, does not commit.
+    """
+    if not snapshots:
+        return []
+
+    snapshot_ids = reserve_ids(db, MeterSnapshot.__tablename__, len(snapshots))
+    snapshot_rows, heat_rows, electricity_rows = [], [], []
+    for snapshot_id, snapshot in zip(snapshot_ids, snapshots):
+        row = _row(snapshot, SNAPSHOT_COLUMNS)
+        row['id'] = snapshot_id
+        row['creation_date'] = row['creation_date'] or datetime.utcnow()
+        snapshot_rows.append(row)
+
+        if row['type'] == MeterType.Electricity:
+            electricity_row = _row(snapshot.get('electricity') or {}, ELECTRICITY_COLUMNS)
+            electricity_row['snapshot_id'] = snapshot_id
+            electricity_rows.append(electricity_row)
+        elif row['type'] == MeterType.Heat:
+            heat_row = _row(snapshot.get('heat') or {}, HEAT_COLUMNS)
+            heat_row['snapshot_id'] = snapshot_id
+            heat_rows.append(heat_row)
+
+    db.execute(MeterSnapshot.__table__.insert().values(snapshot_rows))
+    if heat_rows:
+        db.execute(HeatMeterSnapshot.__table__.insert().values(heat_rows))
+    if electricity_rows:
+        db.execute(ElectricityMeterSnapshot.__table__.insert().values(electricity_rows))
+    add_to_rollups(db, [(row['meter_id'], row['creation_date'], row['consumption']) for row in snapshot_rows])
+    update_last_snapshots(db, snapshot_rows)
+
+    return snapshot_ids
+
+
+class SnapshotBuffer:
+    """
+    Write-behind queue for snapshot dicts accepted by the API. A background thread flushes it with
+    `bulk_insert_snapshots` whenever `flush_size` items are waiting or `flush_interval` seconds have passed.
+    """
+
+    def __init__(self, max_size: int, flush_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def put(self, snapshot: Dict) -> bool:
+        with self._condition:
+            if len(self._items) >= self.max_size:
+                return False
+            self._items.append(snapshot)
+            if len(self._items) >= self.flush_size:
+                self._condition.notify()
+            return True
+
+    def start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='snapshot-buffer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopped and len(self._items) < self.flush_size:
+                    self._condition.wait(timeout=self.flush_interval)
+                batch = [self._items.popleft() for _ in range(min(self.flush_size, len(self._items)))]
+                stopped = self._stopped
+            if batch:
+                try:
+                    self._flush(batch)
+                except Exception:
+                    # Keeps the thread alive, a dead one would leave the buffer full and reject every snapshot
+                    logger.exception('Snapshot buffer flush crashed, dropped up to %s snapshots', len(batch))
+            elif stopped:
+                return
+
+    def _flush(self, batch: List[Dict]):
+        session = db()
+        try:
+            bulk_insert_snapshots(session, batch)
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            self._flush_one_by_one(session, batch)
+        except SQLAlchemyError:
+            session.rollback()
+            logger.exception('Snapshot buffer flush failed, %s snapshots are requeued', len(batch))
+            self._requeue(batch)
+        finally:
+            session.close()
+
+    def _flush_one_by_one(self, session: Session, batch: List[Dict]):
+        for index, snapshot in enumerate(batch):
+            try:
+                bulk_insert_snapshots(session, [snapshot])
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                logger.warning('Dropped buffered snapshot for meter %s: integrity error', snapshot.get('meter_id'))
+            except SQLAlchemyError:
+                session.rollback()
+                logger.exception('Snapshot buffer flush failed, %s snapshots are requeued', len(batch) - index)
+                self._requeue(batch[index:])
+                return
+
+    def _requeue(self, batch: List[Dict]):
+        with self._condition:
+            if self._stopped:
+                logger.error('Snapshot buffer is stopping, dropped %s snapshots', len(batch))
+                return
+            free_space = self.max_size - len(self._items)
+            self._items.extendleft(reversed(batch[:free_space]))
+            if len(batch) > free_space:
+                logger.error('Snapshot buffer is full, dropped %s snapshots', len(batch) - free_space)
+            self._condition.wait(timeout=self.flush_interval)
+
+
+snapshot_buffer = SnapshotBuffer(max_size=INGEST_BUFFER_MAX_SIZE, flush_size=INGEST_FLUSH_SIZE,
+                                 flush_interval=INGEST_FLUSH_INTERVAL_SEC)
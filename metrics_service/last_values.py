@@ -0,0 +1,107 @@
+from typing import Iterable, Dict, List
+
+from sqlalchemy import select, true, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from models.location import Room
+from models.metrics import Meter, MeterSnapshot, EnvironmentalReading, LastMeterSnapshot, LastEnvironmentalReading
+
+LAST_SNAPSHOT_COLUMNS = ['meter_id', 'type', 'consumption', 'automatic', 'creation_date', 'current_time', 'uptime']
+LAST_READING_COLUMNS = ['room_id', 'automatic', 'current_time', 'temperature', 'humidity', 'notes']
+
+
+def _newer(table, excluded, id_column: str, time_column: str):
+    return tuple_(table.c[time_column], table.c[id_column]) < tuple_(excluded[time_column], excluded[id_column])
+
+
+def _upsert_newer(db, model, key: str, id_column: str, time_column: str, rows: List[Dict]):
+    """
+    Upserts one row per key, an existing row is only replaced by a newer one so that late and out of order
+    values never hide the latest. Rows are sorted by key to lock them in the same order in concurrent upserts.
+    """
+    latest = {}
+    for row in rows:
+        if row[key] not in latest or (row[time_column], row[id_column]) > \
+                (latest[row[key]][time_column], latest[row[key]][id_column]):
+            latest[row[key]] = row
+    if not latest:
+        return
+
+    table = model.__table__
+    statement = insert(table).values([latest[key_value] for key_value in sorted(latest)])
+    excluded = statement.excluded
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[key],
+        set_={column.name: excluded[column.name] for column in table.columns if column.name not in ('id', key)},
+        where=_newer(table, excluded, id_column, time_column)
+    ))
+
+
+def _refresh(db, model, key: str, id_column: str, time_column: str, ids: Iterable[int], source_query):
+    """Recomputes the rows of the given keys from the raw data, after a value was changed or removed"""
+    ids = sorted(set(ids))
+    if not ids:
+        return
+    table = model.__table__
+    db.execute(table.delete().where(table.c[key].in_(ids)))
+    columns = [column.name for column in table.columns if column.name != 'id']
+    statement = insert(table).from_select(columns, source_query(ids))
+    excluded = statement.excluded
+    # Keeps a newer value committed by a concurrent upsert since the delete
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[key],
+        set_={column: excluded[column] for column in columns if column != key},
+        where=_newer(table, excluded, id_column, time_column)
+    ))
+
+
+def snapshot_row(meter_snapshot: MeterSnapshot) -> Dict:
+    return {column: getattr(meter_snapshot, column) for column in ['id', *LAST_SNAPSHOT_COLUMNS]}
+
+
+def update_last_snapshots(db, snapshots: Iterable[Dict]):
+    """
+    Keeps last_meter_snapshots up to date with new snapshot dicts holding `id` and LAST_SNAPSHOT_COLUMNS.
+    Has to run in the transaction that inserts the snapshots.
+    """
+    rows = [{'snapshot_id': snapshot['id'], **{column: snapshot[column] for column in LAST_SNAPSHOT_COLUMNS}}
+            for snapshot in snapshots]
+    _upsert_newer(db, LastMeterSnapshot, 'meter_id', 'snapshot_id', 'creation_date', rows)
+
+
+def _last_snapshots_of(meter_ids: List[int]):
+    # One index scan of ix_meter_snapshots_meter_id_creation_date per meter
+    snapshot = select([MeterSnapshot.__table__]).where(MeterSnapshot.meter_id == Meter.id) \
+        .order_by(MeterSnapshot.creation_date.desc(), MeterSnapshot.id.desc()).limit(1).lateral()
+    return select([snapshot.c.meter_id, snapshot.c.id, *[snapshot.c[column] for column in LAST_SNAPSHOT_COLUMNS[1:]]]) \
+        .select_from(Meter.__table__.join(snapshot, true())).where(Meter.id.in_(meter_ids))
+
+
+def refresh_last_snapshots(db, meter_ids: Iterable[int]):
+    _refresh(db, LastMeterSnapshot, 'meter_id', 'snapshot_id', 'creation_date', meter_ids, _last_snapshots_of)
+
+
+def reading_row(environmental_reading: EnvironmentalReading) -> Dict:
+    return {column: getattr(environmental_reading, column) for column in ['id', *LAST_READING_COLUMNS]}
+
+
+def update_last_readings(db, readings: Iterable[Dict]):
+    """
+    Keeps last_environmental_readings up to date with new reading dicts holding `id` and LAST_READING_COLUMNS.
+    Has to run in the transaction that inserts the readings.
+    """
+    rows = [{'reading_id': reading['id'], **{column: reading[column] for column in LAST_READING_COLUMNS}}
+            for reading in readings]
+    _upsert_newer(db, LastEnvironmentalReading, 'room_id', 'reading_id', 'current_time', rows)
+
+
+def _last_readings_of(room_ids: List[int]):
+    # One index scan of ix_environmental_readings_room_id_current_time per room
+    reading = select([EnvironmentalReading.__table__]).where(EnvironmentalReading.room_id == Room.id) \
+        .order_by(EnvironmentalReading.current_time.desc(), EnvironmentalReading.id.desc()).limit(1).lateral()
+    return select([reading.c.room_id, reading.c.id, *[reading.c[column] for column in LAST_READING_COLUMNS[1:]]]) \
+        .select_from(Room.__table__.join(reading, true())).where(Room.id.in_(room_ids))
+
+
+def refresh_last_readings(db, room_ids: Iterable[int]):
+    _refresh(db, LastEnvironmentalReading, 'room_id', 'reading_id', 'current_time', room_ids, _last_readings_of)
@@ -2,12 +2,31 @@ import uvicorn
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
+import auth_api
+import meter_keys
+from db import db, engine
+from filters import compile_filter_plans
+from ingestion import snapshot_buffer, INGEST_BUFFER_ENABLED
 from middlewares.auth_middleware import AuthMiddleware
+from notifications import NotificationListener, NOTIFICATIONS_RECONNECT_SEC
+from partitions import ensure_future_partitions
 from routes import metrics_router
 from routes.metrics import *
 from routes.locations import *
+from routes.principals import *
+
+
+def forget_cached_changes():
+    meter_keys.forget_all_meters()
+    auth_api.forget_all_principals()
+
 
 app = FastAPI()
+# Keeps the caches of this worker up to date with the changes made through the other workers
+notification_listener = NotificationListener(engine, handlers={
+    meter_keys.METER_KEYS_CHANNEL: meter_keys.on_key_change,
+    auth_api.PRINCIPALS_CHANNEL: auth_api.on_evictions,
+}, on_reconnect=forget_cached_changes, reconnect_interval=NOTIFICATIONS_RECONNECT_SEC)
 app.include_router(metrics_router)
 app.add_middleware(AuthMiddleware)
 
@@ -22,5 +41,46 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def warm_up_caches():
+    session = db()
+    try:
+        meter_keys.warm_up(session)
+    finally:
+        session.close()
+
+
+@app.on_event("startup")
+def start_notification_listener():
+    notification_listener.start()
+
+
+@app.on_event("shutdown")
+def stop_notification_listener():
+    notification_listener.stop()
+
+
+@app.on_event("startup")
+def compile_filters():
+    compile_filter_plans()
+
+
+@app.on_event("startup")
+def create_partitions():
+    ensure_future_partitions()
+
+
+@app.on_event("startup")
+def start_ingest_buffer():
+    if INGEST_BUFFER_ENABLED:
+        snapshot_buffer.start()
+
+
+@app.on_event("shutdown")
+def stop_ingest_buffer():
+    if INGEST_BUFFER_ENABLED:
+        snapshot_buffer.stop()
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="localhost", port=8002, log_level="info")
@@ -0,0 +1,90 @@
+import logging
+from os import environ
+from typing import Optional, Iterable, Dict
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from models.metrics import Meter
+from notifications import notify
+
+logger = logging.getLogger(__name__)
+
+METER_KEYS_CACHE_SIZE = int(environ.get('METER_KEYS_CACHE_SIZE', 10000))
+METER_KEYS_CACHE_TTL = int(environ.get('METER_KEYS_CACHE_TTL', 300))
+# Workers forget the keys of a changed meter when it is announced on this channel, the TTL is only a fallback
+METER_KEYS_CHANNEL = 'meter_keys'
+
+secret_keys = TTLCache(max_size=METER_KEYS_CACHE_SIZE, ttl=METER_KEYS_CACHE_TTL)
+recognition_keys = TTLCache(max_size=METER_KEYS_CACHE_SIZE, ttl=METER_KEYS_CACHE_TTL)
+
+
+def remember_meter(meter: Meter):
+    if meter.secret_key:
+        secret_keys.set(str(meter.secret_key), meter.id)
+    if meter.recognition_key:
+        recognition_keys.set(str(meter.recognition_key), meter.id)
+
+
+def forget_meter(meter_id: int):
+    secret_keys.discard_value(meter_id)
+    recognition_keys.discard_value(meter_id)
+
+
+def announce_key_change(db: Session, meter_id: int):
+    """Makes every worker forget the keys of the meter, the notification is sent when the transaction commits"""
+    notify(db, METER_KEYS_CHANNEL, str(meter_id))
+
+
+def forget_all_meters():
+    secret_keys.clear()
+    recognition_keys.clear()
+
+
+def on_key_change(payload: str):
+    forget_meter(int(payload))
+
+
+def get_meter_ids_by_secret_keys(db: Session, keys: Iterable[str]) -> Dict[str, int]:
+    meter_ids = {}
+    missing_keys = []
+    for key in keys:
+        if (meter_id := secret_keys.get(key)) is not None:
+            meter_ids[key] = meter_id
+        elif key:
+            missing_keys.append(key)
+
+    if missing_keys:
+        # A meter changed while it is read is not cached, the keys read may be the ones it had before
+        read_at = secret_keys.generation()
+        for key, meter_id in db.query(Meter.secret_key, Meter.id).filter(Meter.secret_key.in_(missing_keys)):
+            secret_keys.set(key, meter_id, read_at)
+            meter_ids[key] = meter_id
+    return meter_ids
+
+
+def get_meter_id_by_secret_key(db: Session, key: str) -> Optional[int]:
+    return get_meter_ids_by_secret_keys(db, [key]).get(key)
+
+
+def get_meter_id_by_recognition_key(db: Session, key: str) -> Optional[int]:
+    if (meter_id := recognition_keys.get(key)) is not None:
+        return meter_id
+    read_at = recognition_keys.generation()
+    meter_id = db.query(Meter.id).filter(Meter.recognition_key == key).scalar()
+    if meter_id is not None:
+        recognition_keys.set(key, meter_id, read_at)
+    return meter_id
+
+
+def warm_up(db: Session):
+    """Best effort, keys are looked up on demand when the database can't be read at startup"""
+    try:
+        meters = db.query(Meter.id, Meter.secret_key, Meter.recognition_key).order_by(Meter.id.desc()) \
+            .limit(METER_KEYS_CACHE_SIZE).all()
+    except SQLAlchemyError:
+        logger.warning('Meter keys cache was not warmed up', exc_info=True)
+        return
+    for meter in meters:
+        remember_meter(meter)
@@ -1,5 +1,6 @@
 import os
 
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.requests import Request
 from starlette.responses import Response, JSONResponse
@@ -11,12 +12,13 @@ SERVER_API_KEY = os.environ.get('SERVER_API_KEY', '123')
 
 class AuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        headers = dict(request.headers)
-
-        if headers.get('Server-Api-Key') == SERVER_API_KEY:
+        if request.headers.get('Server-Api-Key') == SERVER_API_KEY:
             return await call_next(request)
 
-        if auth_user(headers):
+        # Verified locally, the thread pool is only for the occasional sync of the token revocations
+        if user := await run_in_threadpool(auth_user, request.headers):
+            # Read by permissions.has_permission
+            request.state.user = user
             return await call_next(request)
 
         return JSONResponse(content={'detail': 'Authorization Error'}, status_code=401)
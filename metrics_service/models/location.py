@@ -86,15 +86,15 @@ class ResponsibleUser(Base):
 
     user_id = Column(Integer)
     rank = Column(String(255), nullable=False)
-    building_id = Column(Integer, ForeignKey('buildings.id'))
+    building_id = Column(Integer, ForeignKey('buildings.id'), index=True)
     responsibility = Column(String(255), nullable=True)
 
 
 class Building(Base):
     __tablename__ = 'buildings'
 
-    location_id = Column(Integer, ForeignKey('locations.id', ondelete='CASCADE'), nullable=False)
-    building_type_id = Column(Integer, ForeignKey('building_types.id', ondelete='CASCADE'), nullable=False)
+    location_id = Column(Integer, ForeignKey('locations.id', ondelete='CASCADE'), nullable=False, index=True)
+    building_type_id = Column(Integer, ForeignKey('building_types.id', ondelete='CASCADE'), nullable=False, index=True)
     meters = relationship(Meter, backref="building")
     floors = relationship("Floor", backref="building")
     responsible_people = relationship("ResponsibleUser", backref="building")
@@ -128,7 +128,7 @@ class Building(Base):
 class Floor(Base):
     __tablename__ = 'floors'
 
-    building_id = Column(Integer, ForeignKey('buildings.id', ondelete='CASCADE'), nullable=False)
+    building_id = Column(Integer, ForeignKey('buildings.id', ondelete='CASCADE'), nullable=False, index=True)
     index = Column(String(255), nullable=False)
     height = Column(Numeric, nullable=True, default=None)
     floor_plan_document_id = Column(Integer, nullable=True)
@@ -141,7 +141,7 @@ class Floor(Base):
 class FloorPlanItem(Base):
     __tablename__ = 'floor_items'
 
-    floor_id = Column(Integer, ForeignKey('floors.id', ondelete='CASCADE'), nullable=False)
+    floor_id = Column(Integer, ForeignKey('floors.id', ondelete='CASCADE'), nullable=False, index=True)
     type = Column(Enum(FloorItemType), nullable=False)
     item_id = Column(Integer, nullable=False)
     position_x = Column(Numeric, nullable=False)
@@ -152,7 +152,7 @@ class Room(Base):
     __tablename__ = 'rooms'
 
     index = Column(String(255), nullable=False)
-    floor_id = Column(Integer, ForeignKey('floors.id', ondelete='CASCADE'), nullable=False)
+    floor_id = Column(Integer, ForeignKey('floors.id', ondelete='CASCADE'), nullable=False, index=True)
     designation = Column(String(255), nullable=True)
     size = Column(Numeric, nullable=True, default=None)
     responsible_department = Column(String(255), nullable=True)
@@ -161,12 +161,13 @@ class Room(Base):
     water_equipment = relationship("WaterEquipment", backref="room")
     electric_equipment = relationship("ElectricEquipment", backref="room")
     environmental_readings = relationship('EnvironmentalReading', backref='room')
+    last_environmental_reading = relationship('LastEnvironmentalReading', backref='room', uselist=False)
 
 
 class Window(Base):
     __tablename__ = 'windows'
 
-    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False)
+    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False, index=True)
     amount = Column(Integer, nullable=False)
     type = Column(Enum(WindowType), nullable=False)
     thickness = Column(Numeric, nullable=True)
@@ -176,7 +177,7 @@ class Window(Base):
 class HeatingBattery(Base):
     __tablename__ = 'heating_batteries'
 
-    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False)
+    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False, index=True)
     amount = Column(Integer, nullable=False)
     type = Column(Enum(HeatingBatteryType), nullable=False)
     sections = Column(Integer, nullable=True)
@@ -185,7 +186,7 @@ class HeatingBattery(Base):
 class WaterEquipment(Base):
     __tablename__ = 'water_equipment'
 
-    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False)
+    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False, index=True)
     amount = Column(Integer, nullable=False)
     type = Column(Enum(WaterEquipmentType), nullable=False)
 
@@ -193,7 +194,7 @@ class WaterEquipment(Base):
 class ElectricEquipment(Base):
     __tablename__ = 'electric_equipment'
 
-    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False)
+    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False, index=True)
     amount = Column(Integer, nullable=False)
     group = Column(Enum(ElectricEquipmentGroup), nullable=False)
     type = Column(Enum(ElectricEquipmentType), nullable=False)
@@ -1,12 +1,18 @@
 import enum
 import uuid
 from datetime import datetime
+from os import environ
 
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Enum, Numeric, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Enum, Numeric, Boolean, UniqueConstraint, \
+    Index, select, func, and_
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import relationship, aliased
 
 from db import Base
 
+# Number of the latest snapshots embedded into every meter, the full history is paginated separately
+METER_SNAPSHOTS_EMBEDDED = int(environ.get('METER_SNAPSHOTS_EMBEDDED', 5))
+
 
 class MeterType(enum.Enum):
     Water = 'Water'
@@ -18,8 +24,10 @@ class MeterType(enum.Enum):
 class ElectricityMeterSnapshot(Base):
     __tablename__ = 'electricity_meter_snapshots'
 
-    snapshot_id = Column(Integer, ForeignKey('meter_snapshots.id', ondelete='CASCADE'), unique=True, nullable=False)
-    snapshot = relationship('MeterSnapshot', back_populates='electricity_meter_snapshot')
+    # No foreign key, meter_snapshots is partitioned. Rows are removed by the meter_snapshots_delete_children trigger
+    snapshot_id = Column(Integer, unique=True, nullable=False)
+    snapshot = relationship('MeterSnapshot', back_populates='electricity_meter_snapshot',
+                            primaryjoin='foreign(ElectricityMeterSnapshot.snapshot_id) == MeterSnapshot.id')
     voltage = Column(Numeric, nullable=False)
     current = Column(Numeric, nullable=True)
 
@@ -27,8 +35,10 @@ class ElectricityMeterSnapshot(Base):
 class HeatMeterSnapshot(Base):
     __tablename__ = 'heat_meter_snapshots'
 
-    snapshot_id = Column(Integer, ForeignKey('meter_snapshots.id', ondelete='CASCADE'), unique=True, nullable=False)
-    snapshot = relationship('MeterSnapshot', back_populates='heat_meter_snapshot')
+    # No foreign key, meter_snapshots is partitioned. Rows are removed by the meter_snapshots_delete_children trigger
+    snapshot_id = Column(Integer, unique=True, nullable=False)
+    snapshot = relationship('MeterSnapshot', back_populates='heat_meter_snapshot',
+                            primaryjoin='foreign(HeatMeterSnapshot.snapshot_id) == MeterSnapshot.id')
     incoming_temperature = Column(Numeric, nullable=True)
     outgoing_temperature = Column(Numeric, nullable=True)
     incoming_pump_usage = Column(Numeric, nullable=True)
@@ -42,23 +52,35 @@ class HeatMeterSnapshot(Base):
 
 class MeterSnapshot(Base):
     __tablename__ = 'meter_snapshots'
+    # Monthly partitions are managed by partitions.py, the partition key has to be part of the primary key
+    __table_args__ = {'postgresql_partition_by': 'RANGE (creation_date)'}
 
+    id = Column(Integer, primary_key=True, autoincrement=True)
     meter_id = Column(Integer, ForeignKey('meters.id', ondelete='CASCADE'), nullable=False)
     type = Column(Enum(MeterType), nullable=False)
     consumption = Column(Numeric, nullable=False)
     automatic = Column(Boolean, nullable=False)
-    creation_date = Column(DateTime, default=datetime.utcnow)
+    creation_date = Column(DateTime, primary_key=True, default=datetime.utcnow)
     current_time = Column(DateTime, nullable=True)
     uptime = Column(Numeric, nullable=True, default=None)
 
-    heat_meter_snapshot = relationship(HeatMeterSnapshot, back_populates='snapshot', uselist=False)
-    electricity_meter_snapshot = relationship(ElectricityMeterSnapshot, back_populates='snapshot', uselist=False)
+    heat_meter_snapshot = relationship(HeatMeterSnapshot, back_populates='snapshot', uselist=False,
+                                       primaryjoin='MeterSnapshot.id == foreign(HeatMeterSnapshot.snapshot_id)')
+    electricity_meter_snapshot = relationship(ElectricityMeterSnapshot, back_populates='snapshot', uselist=False,
+                                              primaryjoin='MeterSnapshot.id == '
+                                                          'foreign(ElectricityMeterSnapshot.snapshot_id)')
+
+
+# Built concurrently per partition by the time_series_indexes migration
+Index('ix_meter_snapshots_meter_id_creation_date',
+      MeterSnapshot.meter_id, MeterSnapshot.creation_date.desc(), MeterSnapshot.id.desc())
+Index('ix_meter_snapshots_creation_date_brin', MeterSnapshot.creation_date, postgresql_using='brin')
 
 
 class Meter(Base):
     __tablename__ = 'meters'
 
-    building_id = Column(Integer, ForeignKey('buildings.id', ondelete='SET NULL'), nullable=True)
+    building_id = Column(Integer, ForeignKey('buildings.id', ondelete='SET NULL'), nullable=True, index=True)
     type = Column(Enum(MeterType), nullable=False)
     serial_number = Column(String(255), unique=True, nullable=False)
     model_number = Column(String(255), nullable=False)
@@ -76,8 +98,8 @@ class Meter(Base):
     snapshots = relationship(MeterSnapshot, backref='meter')
     electricity = relationship('ElectricityMeter', back_populates='meter', uselist=False)
 
-    secret_key = Column(String(255), default=uuid.uuid4, nullable=True)
-    recognition_key = Column(String(255), default=uuid.uuid4, nullable=True)
+    secret_key = Column(String(255), default=uuid.uuid4, nullable=True, unique=True, index=True)
+    recognition_key = Column(String(255), default=uuid.uuid4, nullable=True, unique=True, index=True)
 
     is_working = Column(Boolean, default=True)
     average_hours_per_day_usage = Column(Integer, nullable=True)
@@ -95,10 +117,90 @@ class ElectricityMeter(Base):
 
 class EnvironmentalReading(Base):
     __tablename__ = 'environmental_readings'
+    __table_args__ = {'postgresql_partition_by': 'RANGE ("current_time")'}
 
+    id = Column(Integer, primary_key=True, autoincrement=True)
     room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False)
     automatic = Column(Boolean, nullable=True, default=True)
+    current_time = Column(DateTime, primary_key=True)
+    temperature = Column(Numeric, nullable=True)
+    humidity = Column(Numeric, nullable=True)
+    notes = Column(String(255), nullable=True)
+
+
+Index('ix_environmental_readings_room_id_current_time', EnvironmentalReading.room_id, EnvironmentalReading.current_time)
+Index('ix_environmental_readings_current_time_brin', EnvironmentalReading.current_time, postgresql_using='brin')
+
+
+class LastMeterSnapshot(Base):
+    """Latest snapshot of every meter by creation_date, maintained on ingest by last_values.py"""
+    __tablename__ = 'last_meter_snapshots'
+
+    meter_id = Column(Integer, ForeignKey('meters.id', ondelete='CASCADE'), nullable=False, unique=True)
+    meter = relationship(Meter)
+    # No foreign key, meter_snapshots is partitioned
+    snapshot_id = Column(Integer, nullable=False)
+    type = Column(Enum(MeterType), nullable=False)
+    consumption = Column(Numeric, nullable=False)
+    automatic = Column(Boolean, nullable=False)
+    creation_date = Column(DateTime, nullable=False)
+    current_time = Column(DateTime, nullable=True)
+    uptime = Column(Numeric, nullable=True)
+
+
+class LastEnvironmentalReading(Base):
+    """Latest environmental reading of every room by current_time, maintained on ingest by last_values.py"""
+    __tablename__ = 'last_environmental_readings'
+
+    room_id = Column(Integer, ForeignKey('rooms.id', ondelete='CASCADE'), nullable=False, unique=True)
+    # No foreign key, environmental_readings is partitioned
+    reading_id = Column(Integer, nullable=False)
+    automatic = Column(Boolean, nullable=True)
     current_time = Column(DateTime, nullable=False)
     temperature = Column(Numeric, nullable=True)
     humidity = Column(Numeric, nullable=True)
     notes = Column(String(255), nullable=True)
+
+
+class MeterConsumptionRollup:
+    """Consumption of one meter aggregated over a time bucket, maintained by rollups.py"""
+
+    @declared_attr
+    def __table_args__(cls):
+        return UniqueConstraint('meter_id', 'bucket'),
+
+    @declared_attr
+    def meter_id(cls):
+        return Column(Integer, ForeignKey('meters.id', ondelete='CASCADE'), nullable=False)
+
+    bucket = Column(DateTime, nullable=False)
+    min_consumption = Column(Numeric, nullable=False)
+    max_consumption = Column(Numeric, nullable=False)
+    sum_consumption = Column(Numeric, nullable=False)
+    count = Column(Integer, nullable=False)
+    first_time = Column(DateTime, nullable=False)
+    first_consumption = Column(Numeric, nullable=False)
+    last_time = Column(DateTime, nullable=False)
+    last_consumption = Column(Numeric, nullable=False)
+
+
+class HourlyMeterConsumption(MeterConsumptionRollup, Base):
+    __tablename__ = 'hourly_meter_consumption'
+
+
+class DailyMeterConsumption(MeterConsumptionRollup, Base):
+    __tablename__ = 'daily_meter_consumption'
+
+
+_numbered_snapshots = select([
+    MeterSnapshot.__table__,
+    func.row_number().over(partition_by=MeterSnapshot.meter_id,
+                           order_by=(MeterSnapshot.creation_date.desc(), MeterSnapshot.id.desc())).label('row_number'),
+]).alias('numbered_meter_snapshots')
+LatestMeterSnapshot = aliased(MeterSnapshot, _numbered_snapshots)
+
+# One windowed query for all meters of a page when loaded with selectinload
+Meter.latest_snapshots = relationship(LatestMeterSnapshot, viewonly=True,
+                                      primaryjoin=and_(LatestMeterSnapshot.meter_id == Meter.id,
+                                                       _numbered_snapshots.c.row_number <= METER_SNAPSHOTS_EMBEDDED),
+                                      order_by=_numbered_snapshots.c.row_number)
@@ -0,0 +1,79 @@
+import logging
+import select
+import threading
+from os import environ
+from typing import Callable, Dict
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import func
+from sqlalchemy import select as sql_select
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATIONS_RECONNECT_SEC = float(environ.get('NOTIFICATIONS_RECONNECT_SEC', 5))
+
+
+def notify(db: Session, channel: str, payload: str):
+    """Announces `payload` to every worker listening on `channel`, the notification is sent when `db` commits"""
+    db.execute(sql_select([func.pg_notify(channel, payload)]))
+
+
+class NotificationListener:
+    """
+    Background thread that LISTENs on the channels of `handlers` and passes the payload of every notification to
+    the handler of its channel. Notifications sent while it is disconnected are lost, so `on_reconnect` is called
+    whenever it connects again, for the caches kept up to date by the handlers to be cleared.
+    """
+
+    def __init__(self, engine, handlers: Dict[str, Callable[[str], None]], on_reconnect: Callable[[], None],
+                 reconnect_interval: float):
+        self.engine = engine
+        self.handlers = handlers
+        self.on_reconnect = on_reconnect
+        self.reconnect_interval = reconnect_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._connections = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='notification-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.warning('Notification listener disconnected, reconnecting', exc_info=True)
+            self._stop.wait(self.reconnect_interval)
+
+    def _listen(self):
+        # A dedicated connection, it is kept out of the pool while it listens
+        connection = self.engine.raw_connection()
+        connection.detach()
+        try:
+            connection.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            for channel in self.handlers:
+                connection.cursor().execute(f'LISTEN {channel}')
+            if self._connections:
+                self.on_reconnect()
+            self._connections += 1
+            while not self._stop.is_set():
+                if select.select([connection.connection], [], [], 1) == ([], [], []):
+                    continue
+                connection.connection.poll()
+                while connection.connection.notifies:
+                    notification = connection.connection.notifies.pop(0)
+                    try:
+                        self.handlers[notification.channel](notification.payload)
+                    except Exception:
+                        logger.exception('Notification on %s was not handled', notification.channel)
+        finally:
+            connection.close()
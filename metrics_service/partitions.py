@@ -0,0 +1,132 @@
+import argparse
+import re
+from datetime import date, datetime
+from os import environ
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from db import engine
+
+PARTITION_MONTHS_AHEAD = int(environ.get('PARTITION_MONTHS_AHEAD', 3))
+
+# Tables range partitioned by month, with their partition key column
+PARTITIONED_TABLES = {
+    'meter_snapshots': 'creation_date',
+    'environmental_readings': 'current_time',
+}
+
+# Tables keyed by meter_snapshots.id, they can't have a foreign key to a partitioned table
+SNAPSHOT_CHILD_TABLES = ('heat_meter_snapshots', 'electricity_meter_snapshots')
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table_name: str, month: date) -> str:
+    return f'{table_name}_y{month.year}m{month.month:02d}'
+
+
+def create_partition(connection: Connection, table_name: str, month: date) -> bool:
+    """
+    Creates the partition of `table_name` for `month` unless it exists. Rows of that month which already landed
+    in the default partition are moved into it before it is attached.
+    """
+    name = partition_name(table_name, month)
+    column = PARTITIONED_TABLES[table_name]
+    start, end = month, add_months(month, 1)
+    in_range = f'"{column}" >= \'{start}\' AND "{column}" < \'{end}\''
+
+    with connection.begin():
+        connection.execute(text('SELECT pg_advisory_xact_lock(hashtext(:name))'), {'name': name})
+        if connection.execute(text('SELECT to_regclass(:name) IS NOT NULL'), {'name': name}).scalar():
+            return False
+
+        # Keeps the meter_snapshots delete trigger from removing the child rows of the moved snapshots
+        connection.execute("SET LOCAL metrics.moving_partition_rows = 'on'")
+        connection.execute(f'CREATE TABLE {name} (LIKE {table_name} INCLUDING DEFAULTS)')
+        connection.execute(f'WITH moved AS (DELETE FROM {table_name}_default WHERE {in_range} RETURNING *) '
+                           f'INSERT INTO {name} SELECT * FROM moved')
+        connection.execute(f"ALTER TABLE {table_name} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+    return True
+
+
+def ensure_partitions(connection: Connection, table_name: str, start: date, end: date) -> List[str]:
+    created = []
+    month, last_month = month_start(start), month_start(end)
+    while month <= last_month:
+        if create_partition(connection, table_name, month):
+            created.append(partition_name(table_name, month))
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_future_partitions(months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    today = datetime.utcnow().date()
+    with engine.connect() as connection:
+        return [name for table_name in PARTITIONED_TABLES
+                for name in ensure_partitions(connection, table_name, today, add_months(today, months_ahead))]
+
+
+def attached_partitions(connection: Connection, table_name: str) -> List[Tuple[str, date]]:
+    pattern = re.compile(rf'^{table_name}_y(\d{{4}})m(\d{{2}})$')
+    rows = connection.execute(text('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                                   'WHERE i.inhparent = CAST(:table_name AS regclass) ORDER BY c.relname'),
+                              {'table_name': table_name})
+    partitions = []
+    for name, in rows:
+        match = pattern.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return partitions
+
+
+def detach_partitions(connection: Connection, table_name: str, before: date, drop: bool = False) -> List[str]:
+    """
+    Detaches every monthly partition of `table_name` that only holds rows older than `before`. Detached
+    partitions stay as plain tables unless `drop` is set, then they are dropped together with their
+    heat/electricity snapshot rows.
+    """
+    detached = []
+    for name, month in attached_partitions(connection, table_name):
+        if add_months(month, 1) > before:
+            continue
+        with connection.begin():
+            connection.execute(f'ALTER TABLE {table_name} DETACH PARTITION {name}')
+            if drop:
+                if table_name == 'meter_snapshots':
+                    for child_table in SNAPSHOT_CHILD_TABLES:
+                        connection.execute(f'DELETE FROM {child_table} WHERE snapshot_id IN (SELECT id FROM {name})')
+                connection.execute(f'DROP TABLE {name}')
+        detached.append(name)
+    return detached
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monthly partitions of meter_snapshots and environmental_readings')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ensure_parser = subparsers.add_parser('ensure', help='create partitions from the current month on')
+    ensure_parser.add_argument('--months-ahead', type=int, default=PARTITION_MONTHS_AHEAD)
+
+    detach_parser = subparsers.add_parser('detach', help='detach partitions with data older than a date')
+    detach_parser.add_argument('--before', type=date.fromisoformat, required=True, help='YYYY-MM-DD')
+    detach_parser.add_argument('--table', choices=list(PARTITIONED_TABLES), action='append')
+    detach_parser.add_argument('--drop', action='store_true', help='drop detached partitions instead of keeping them')
+
+    args = parser.parse_args()
+    if args.command == 'ensure':
+        names = ensure_future_partitions(args.months_ahead)
+        print(f'Created {len(names)} partitions' + ''.join(f'\n  {name}' for name in names))
+    else:
+        with engine.connect() as connection:
+            for table in args.table or PARTITIONED_TABLES:
+                for name in detach_partitions(connection, table, args.before, args.drop):
+                    print(f'{"Dropped" if args.drop else "Detached"} {name}')
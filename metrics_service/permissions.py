@@ -9,9 +9,15 @@ from auth_api import SERVER_API_KEY, auth_user
 def has_permission(request: Request, permission_name):
     if os.environ.get('DEBUG') == 'True':
         return True
-    if dict(request.headers).get('Server-Api-Key') == SERVER_API_KEY:
+    if request.headers.get('Server-Api-Key') == SERVER_API_KEY:
         return
-    user = auth_user(request.headers)
-    if permission_name not in user.permissions:
+    user = getattr(request.state, 'user', None) or auth_user(request.headers)
+    if not user or permission_name not in user.permissions:
         raise HTTPException(detail='User has no permissions for this action', status_code=status.HTTP_403_FORBIDDEN)
     return
+
+
+def has_server_api_key(request: Request):
+    """Only lets other services through, for the endpoints called by them"""
+    if request.headers.get('Server-Api-Key') != SERVER_API_KEY:
+        raise HTTPException(detail='Only available to other services', status_code=status.HTTP_403_FORBIDDEN)
@@ -1,6 +1,7 @@
-from typing import List, Type
+from typing import List, Type, Optional
 
 from pydantic.main import BaseModel
+from pydantic.utils import GetterDict
 
 
 def _remove_fields(model, fields_to_remove: List):
@@ -25,11 +26,24 @@ def make_add_model(model: BaseModel, fields_to_remove: List[str] = None) -> Base
     return type(f'Add{model.__name__}Model', (BaseModel,), dict(model.__dict__))
 
 
+def read_from(**attributes: str) -> Type[GetterDict]:
+    """getter_dict of orm_mode models whose fields are read from differently named attributes of the ORM object"""
+    class RenamedAttributesGetterDict(GetterDict):
+        orm_attributes = attributes
+
+        def get(self, key, default=None):
+            return getattr(self._obj, attributes.get(key, key), default)
+
+    return RenamedAttributesGetterDict
+
+
 def create_pagination_model(entity_type: Type['BaseModel']) -> BaseModel:
     class PaginationModel(BaseModel):
-        total_size: int
+        total_size: Optional[int]
+        total_size_mode: str
         page_number: int
         page_size: int
+        next_after: Optional[str]
         items: List[entity_type]
 
     return type(f'Paginate{entity_type.__name__}', (BaseModel,), dict(PaginationModel.__dict__))
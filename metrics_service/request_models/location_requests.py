@@ -1,4 +1,4 @@
-from typing import List, Any
+from typing import List, Any, Optional
 
 from pydantic.main import BaseModel
 from pydantic_sqlalchemy import sqlalchemy_to_pydantic
@@ -31,11 +31,16 @@ class UserModel(BaseModel):
     permissions: List[str]
 
 
+class UserIdsModel(BaseModel):
+    user_ids: List[int]
+
+
 class ResponsibleUserModel(BaseModel):
     id: int
     rank: str
     building_id: int
-    user: UserModel
+    # None while the auth service is unavailable and the user isn't cached
+    user: Optional[UserModel]
 
 
 class RoomModel(sqlalchemy_to_pydantic(Room)):
@@ -1,3 +1,4 @@
+import enum
 from datetime import datetime
 from typing import List, Optional
 
@@ -5,13 +6,18 @@ from pydantic.main import BaseModel
 from pydantic_sqlalchemy import sqlalchemy_to_pydantic
 
 from models.metrics import Meter, ElectricityMeter, MeterSnapshot, HeatMeterSnapshot, \
-    ElectricityMeterSnapshot, EnvironmentalReading
-from request_models import make_change_model, make_add_model
+    ElectricityMeterSnapshot, EnvironmentalReading, HourlyMeterConsumption, DailyMeterConsumption, MeterType, \
+    LastMeterSnapshot, LastEnvironmentalReading
+from request_models import make_change_model, make_add_model, read_from
 
 ElectricityMeterModel = sqlalchemy_to_pydantic(ElectricityMeter)
 HeatMeterSnapshotModel = sqlalchemy_to_pydantic(HeatMeterSnapshot)
 ElectricityMeterSnapshotModel = sqlalchemy_to_pydantic(ElectricityMeterSnapshot)
 EnvironmentalReadingModel = sqlalchemy_to_pydantic(EnvironmentalReading)
+HourlyMeterConsumptionModel = sqlalchemy_to_pydantic(HourlyMeterConsumption)
+DailyMeterConsumptionModel = sqlalchemy_to_pydantic(DailyMeterConsumption)
+LastMeterSnapshotModel = sqlalchemy_to_pydantic(LastMeterSnapshot)
+LastEnvironmentalReadingModel = sqlalchemy_to_pydantic(LastEnvironmentalReading)
 
 
 class MeterSnapshotModel(sqlalchemy_to_pydantic(MeterSnapshot)):
@@ -27,6 +33,10 @@ class MeterModel(sqlalchemy_to_pydantic(Meter)):
     electricity: Optional[ElectricityMeterModel]
     snapshots: List[MeterSnapshotModel]
 
+    class Config:
+        # The latest METER_SNAPSHOTS_EMBEDDED snapshots only, the history is paginated by /meters/{meter_id}/snapshots/
+        getter_dict = read_from(snapshots='latest_snapshots')
+
 
 class AddReadingModel(BaseModel):
     value: str
@@ -67,6 +77,23 @@ class AddAutoMeterSnapshotModel(make_add_model(sqlalchemy_to_pydantic(MeterSnaps
     electricity: Optional[AddElectricityMeterSnapshotModel]
 
 
+class AddAutoMeterSnapshotBatchItemModel(AddAutoMeterSnapshotModel):
+    secret_key: Optional[str]
+
+
+class MeterSnapshotBatchItemStatusModel(BaseModel):
+    index: int
+    created: bool
+    id: Optional[int]
+    detail: Optional[str]
+
+
+class MeterSnapshotBatchResultModel(BaseModel):
+    created: int
+    failed: int
+    items: List[MeterSnapshotBatchItemStatusModel]
+
+
 ChangeHeatMeterSnapshotModel = make_change_model(sqlalchemy_to_pydantic(HeatMeterSnapshot))
 ChangeElectricityMeterSnapshotModel = make_change_model(sqlalchemy_to_pydantic(ElectricityMeterSnapshot))
 ChangeEnvironmentalReadingModel = make_change_model(sqlalchemy_to_pydantic(EnvironmentalReading),
@@ -77,3 +104,39 @@ class ChangeMeterSnapshotModel(make_change_model(sqlalchemy_to_pydantic(MeterSna
                                                  fields_to_remove=['meter_id', 'automatic'])):
     heat: Optional[ChangeHeatMeterSnapshotModel]
     electricity: Optional[ChangeElectricityMeterSnapshotModel]
+
+
+class ConsumptionBucket(enum.Enum):
+    hour = 'hour'
+    day = 'day'
+    week = 'week'
+    month = 'month'
+
+
+class ConsumptionAggregateModel(BaseModel):
+    building_id: Optional[int]
+    type: MeterType
+    bucket: datetime
+    total_consumption: float
+    average_consumption: float
+    snapshot_count: int
+
+
+class ConsumptionAggregationModel(BaseModel):
+    start: datetime
+    end: datetime
+    bucket: ConsumptionBucket
+    items: List[ConsumptionAggregateModel]
+
+
+class DownsamplingMethod(enum.Enum):
+    lttb = 'lttb'
+    minmax = 'minmax'
+
+
+class MeterSnapshotSeriesModel(BaseModel):
+    meter_id: int
+    method: DownsamplingMethod
+    raw_count: int
+    time: List[datetime]
+    consumption: List[float]
@@ -0,0 +1,149 @@
+import argparse
+from datetime import datetime, timedelta, date
+from decimal import Decimal
+from typing import Iterable, List, Tuple, Optional
+
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.dialects.postgresql import insert, aggregate_order_by
+
+from db import engine
+from models.metrics import MeterSnapshot, HourlyMeterConsumption, DailyMeterConsumption
+from partitions import month_start, add_months
+
+# date_trunc precision of every rollup table
+ROLLUPS = {
+    'hour': HourlyMeterConsumption,
+    'day': DailyMeterConsumption,
+}
+
+ROLLUP_COLUMNS = ['meter_id', 'bucket', 'min_consumption', 'max_consumption', 'sum_consumption', 'count',
+                  'first_time', 'first_consumption', 'last_time', 'last_consumption']
+
+
+def truncate(value: datetime, precision: str) -> datetime:
+    value = value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if precision == 'day' else value
+
+
+def bucket_length(precision: str) -> timedelta:
+    return timedelta(days=1) if precision == 'day' else timedelta(hours=1)
+
+
+def _aggregate_snapshots(precision: str, condition):
+    bucket = func.date_trunc(precision, MeterSnapshot.creation_date)
+    return select([
+        MeterSnapshot.meter_id,
+        bucket,
+        func.min(MeterSnapshot.consumption),
+        func.max(MeterSnapshot.consumption),
+        func.sum(MeterSnapshot.consumption),
+        func.count(),
+        func.min(MeterSnapshot.creation_date),
+        func.array_agg(aggregate_order_by(MeterSnapshot.consumption, MeterSnapshot.creation_date))[1],
+        func.max(MeterSnapshot.creation_date),
+        func.array_agg(aggregate_order_by(MeterSnapshot.consumption, MeterSnapshot.creation_date.desc()))[1],
+    ]).where(condition).group_by(MeterSnapshot.meter_id, bucket)
+
+
+def add_to_rollups(db, snapshots: Iterable[Tuple[int, datetime, Decimal]]):
+    """
+    Adds new (meter_id, creation_date, consumption) snapshots to every rollup with one upsert per table.
+    Has to run in the transaction that inserts the snapshots.
+    """
+    snapshots = sorted(snapshots, key=lambda snapshot: snapshot[1])
+    if not snapshots:
+        return
+
+    for precision, model in ROLLUPS.items():
+        buckets = {}
+        for meter_id, creation_date, consumption in snapshots:
+            key = (meter_id, truncate(creation_date, precision))
+            row = buckets.get(key)
+            if row is None:
+                buckets[key] = dict(zip(ROLLUP_COLUMNS, (*key, consumption, consumption, consumption, 1,
+                                                         creation_date, consumption, creation_date, consumption)))
+                continue
+            row['min_consumption'] = min(row['min_consumption'], consumption)
+            row['max_consumption'] = max(row['max_consumption'], consumption)
+            row['sum_consumption'] += consumption
+            row['count'] += 1
+            row['last_time'], row['last_consumption'] = creation_date, consumption
+
+        # Sorted rows keep concurrent upserts from locking the same buckets in a different order
+        table = model.__table__
+        statement = insert(table).values([buckets[key] for key in sorted(buckets)])
+        excluded = statement.excluded
+        db.execute(statement.on_conflict_do_update(
+            index_elements=['meter_id', 'bucket'],
+            set_={
+                'min_consumption': func.least(table.c.min_consumption, excluded.min_consumption),
+                'max_consumption': func.greatest(table.c.max_consumption, excluded.max_consumption),
+                'sum_consumption': table.c.sum_consumption + excluded.sum_consumption,
+                'count': table.c['count'] + excluded['count'],
+                'first_time': func.least(table.c.first_time, excluded.first_time),
+                'first_consumption': case([(excluded.first_time < table.c.first_time, excluded.first_consumption)],
+                                          else_=table.c.first_consumption),
+                'last_time': func.greatest(table.c.last_time, excluded.last_time),
+                'last_consumption': case([(excluded.last_time >= table.c.last_time, excluded.last_consumption)],
+                                         else_=table.c.last_consumption),
+            }
+        ))
+
+
+def refresh_rollups(db, snapshots: Iterable[Tuple[int, datetime]]):
+    """
+    Recomputes the buckets holding the given (meter_id, creation_date) pairs from the raw snapshots,
+    used after a snapshot was changed or removed.
+    """
+    snapshots = list(snapshots)
+    for precision, model in ROLLUPS.items():
+        table = model.__table__
+        for meter_id, bucket in sorted({(meter_id, truncate(creation_date, precision))
+                                        for meter_id, creation_date in snapshots}):
+            db.execute(table.delete().where(and_(table.c.meter_id == meter_id, table.c.bucket == bucket)))
+            db.execute(table.insert().from_select(ROLLUP_COLUMNS, _aggregate_snapshots(precision, and_(
+                MeterSnapshot.meter_id == meter_id,
+                MeterSnapshot.creation_date >= bucket,
+                MeterSnapshot.creation_date < bucket + bucket_length(precision),
+            ))))
+
+
+def rebuild_rollups(start: date, end: date, meter_id: Optional[int] = None) -> List[date]:
+    """Recomputes every rollup from the raw snapshots month by month, one transaction per month"""
+    months = []
+    month = month_start(start)
+    with engine.connect() as connection:
+        while month <= end:
+            next_month = add_months(month, 1)
+            snapshot_condition = and_(MeterSnapshot.creation_date >= month, MeterSnapshot.creation_date < next_month)
+            if meter_id is not None:
+                snapshot_condition = and_(snapshot_condition, MeterSnapshot.meter_id == meter_id)
+
+            with connection.begin():
+                for precision, model in ROLLUPS.items():
+                    table = model.__table__
+                    rollup_condition = and_(table.c.bucket >= month, table.c.bucket < next_month)
+                    if meter_id is not None:
+                        rollup_condition = and_(rollup_condition, table.c.meter_id == meter_id)
+                    connection.execute(table.delete().where(rollup_condition))
+                    connection.execute(table.insert().from_select(ROLLUP_COLUMNS,
+                                                                  _aggregate_snapshots(precision, snapshot_condition)))
+            months.append(month)
+            month = next_month
+    return months
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild hourly and daily meter consumption rollups')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--start', type=date.fromisoformat, help='YYYY-MM-DD, defaults to the oldest snapshot')
+    parser.add_argument('--end', type=date.fromisoformat, help='YYYY-MM-DD, defaults to today')
+    parser.add_argument('--meter-id', type=int)
+    args = parser.parse_args()
+
+    start = args.start
+    if start is None:
+        with engine.connect() as connection:
+            start = connection.execute(select([func.min(MeterSnapshot.creation_date)])).scalar() or datetime.utcnow()
+    for rebuilt_month in rebuild_rollups(start, args.end or datetime.utcnow().date(), args.meter_id):
+        print(f'Rebuilt {rebuilt_month:%Y-%m}')
@@ -1,8 +1,8 @@
 from fastapi import Depends, HTTPException, Request
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
-from auth_api import get_user
+from auth_api import get_users
 from db import get_db
 from models import PermissionSet
 from models.location import Building, BuildingType
@@ -11,11 +11,11 @@ from request_models import create_pagination_model
 from request_models.location_requests import BuildingModel, AddBuildingModel, ChangeBuildingModel, BuildingTypeModel, \
     AddBuildingTypeModel, BuildingTypeCountModel
 from routes import metrics_router
-from utils import paginate, apply_filtering
+from utils import paginate, apply_filtering, build_page, page_response
 
 
 @metrics_router.get("/building-types/", status_code=200, response_model=create_pagination_model(BuildingTypeModel))
-async def get_building_types(request: Request, db: Session = Depends(get_db), ):
+def get_building_types(request: Request, db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.BuildingTypeRead.value)
     return paginate(
         db=db,
@@ -27,20 +27,23 @@ async def get_building_types(request: Request, db: Session = Depends(get_db), ):
 
 @metrics_router.get("/building-types/count/", status_code=200,
                     response_model=create_pagination_model(BuildingTypeCountModel))
-async def get_building_types_count(request: Request, db: Session = Depends(get_db)):
+def get_building_types_count(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingTypeRead.value)
-    result_models, count, page_number = apply_filtering(db, BuildingType, request)
+    result_models, count, count_mode, page_number, next_after = apply_filtering(
+        db, BuildingType, request, options=[selectinload(BuildingType.buildings).load_only('id')])
     items = [BuildingTypeCountModel(id=b.id, name=b.name, buildings_count=len(b.buildings)) for b in result_models]
     return {
         'total_size': count,
+        'total_size_mode': count_mode,
         'page_number': page_number,
         'page_size': len(items),
+        'next_after': next_after,
         'items': items
     }
 
 
 @metrics_router.post("/building-types/", status_code=201, response_model=BuildingTypeModel)
-async def add_building_type(request: Request, body: AddBuildingTypeModel, db: Session = Depends(get_db)):
+def add_building_type(request: Request, body: AddBuildingTypeModel, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingTypeEdit.value)
     building_type = BuildingType(name=body.name)
     db.add(building_type)
@@ -52,8 +55,8 @@ async def add_building_type(request: Request, body: AddBuildingTypeModel, db: Se
 
 
 @metrics_router.patch("/building-types/{building_type_id}", status_code=200, response_model=BuildingTypeModel)
-async def patch_building_type(request: Request, building_type_id: int, body: AddBuildingTypeModel,
-                              db: Session = Depends(get_db), ):
+def patch_building_type(request: Request, building_type_id: int, body: AddBuildingTypeModel,
+                        db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.BuildingTypeEdit.value)
     building_type = db.query(BuildingType).filter_by(id=building_type_id).first()
 
@@ -64,7 +67,7 @@ async def patch_building_type(request: Request, building_type_id: int, body: Add
 
 
 @metrics_router.delete("/building-types/{building_type_id}/", status_code=200)
-async def remove_building_type(request: Request, building_type_id: int, db: Session = Depends(get_db)):
+def remove_building_type(request: Request, building_type_id: int, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingTypeEdit.value)
     db.query(BuildingType).filter_by(id=building_type_id).delete()
     db.commit()
@@ -72,22 +75,24 @@ async def remove_building_type(request: Request, building_type_id: int, db: Sess
 
 
 @metrics_router.get("/buildings/", status_code=200, response_model=create_pagination_model(BuildingModel))
-async def get_buildings(request: Request, db: Session = Depends(get_db)):
+def get_buildings(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingRead.value)
-    paginated = paginate(
+    paginated, sparse = build_page(
         db=db,
         db_model=Building,
         serializer=BuildingModel,
         request=request
     )
-    for index, building in enumerate(paginated['items']):
-        for user in building.responsible_people:
-            user.user = get_user(user.user_id)
-    return paginated
+    responsible_people = [user for building in paginated['items']
+                          for user in getattr(building, 'responsible_people', None) or []]
+    users = get_users(user.user_id for user in responsible_people)
+    for user in responsible_people:
+        user.user = users.get(user.user_id)
+    return page_response(paginated, sparse)
 
 
 @metrics_router.post("/buildings/", status_code=201, response_model=BuildingModel)
-async def add_building(request: Request, body: AddBuildingModel, db: Session = Depends(get_db)):
+def add_building(request: Request, body: AddBuildingModel, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingEdit.value)
     building = Building(**body.dict())
     db.add(building)
@@ -99,8 +104,8 @@ async def add_building(request: Request, body: AddBuildingModel, db: Session = D
 
 
 @metrics_router.patch("/buildings/{building_id}", status_code=200, response_model=BuildingModel)
-async def patch_building(request: Request, building_id: int, body: ChangeBuildingModel,
-                         db: Session = Depends(get_db)):
+def patch_building(request: Request, building_id: int, body: ChangeBuildingModel,
+                   db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingEdit.value)
     building = db.query(Building).filter_by(id=building_id).first()
 
@@ -115,7 +120,7 @@ async def patch_building(request: Request, building_id: int, body: ChangeBuildin
 
 
 @metrics_router.delete("/buildings/{building_id}/", status_code=200)
-async def remove_building(request: Request, building_id: int, db: Session = Depends(get_db)):
+def remove_building(request: Request, building_id: int, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingEdit.value)
     db.query(Building).filter_by(id=building_id).delete()
     db.commit()
@@ -16,7 +16,7 @@ from utils import paginate
 
 
 @metrics_router.get("/floors/", status_code=200, response_model=create_pagination_model(FloorModel))
-async def get_floors(request: Request, db: Session = Depends(get_db)):
+def get_floors(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.FloorRead.value)
     return paginate(
         db=db,
@@ -27,7 +27,7 @@ async def get_floors(request: Request, db: Session = Depends(get_db)):
 
 
 @metrics_router.post("/floors/", status_code=201, response_model=FloorModel)
-async def add_floor(request: Request, body: AddFloorModel, db: Session = Depends(get_db)):
+def add_floor(request: Request, body: AddFloorModel, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.FloorEdit.value)
     floor = Floor(**body.dict())
     db.add(floor)
@@ -39,7 +39,7 @@ async def add_floor(request: Request, body: AddFloorModel, db: Session = Depends
 
 
 @metrics_router.patch("/floors/{floor_id}", status_code=200, response_model=FloorModel)
-async def patch_floor(request: Request, floor_id: int, body: ChangeFloorModel, db: Session = Depends(get_db), ):
+def patch_floor(request: Request, floor_id: int, body: ChangeFloorModel, db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.FloorEdit.value)
     floor = db.query(Floor).filter_by(id=floor_id).first()
     if not floor:
@@ -56,7 +56,7 @@ async def patch_floor(request: Request, floor_id: int, body: ChangeFloorModel, d
 
 
 @metrics_router.delete("/floors/{floor_id}/", status_code=200)
-async def remove_floor(request: Request, floor_id: int, db: Session = Depends(get_db)):
+def remove_floor(request: Request, floor_id: int, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.FloorEdit.value)
     db.query(Floor).filter_by(id=floor_id).delete()
     db.commit()
@@ -64,7 +64,7 @@ async def remove_floor(request: Request, floor_id: int, db: Session = Depends(ge
 
 
 @metrics_router.post("/floor-plan-items/", status_code=201, response_model=FloorPlanItemModel)
-async def add_floor_plan_item(request: Request, body: AddFloorPlanItemModel, db: Session = Depends(get_db), ):
+def add_floor_plan_item(request: Request, body: AddFloorPlanItemModel, db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.FloorEdit.value)
     if not (floor := db.query(Floor).filter_by(id=body.floor_id).first()):
         raise HTTPException(detail='Floor does not exist', status_code=404)
@@ -86,8 +86,8 @@ async def add_floor_plan_item(request: Request, body: AddFloorPlanItemModel, db:
 
 
 @metrics_router.delete("/floor-plan-items/{floor_plan_item_id}/", status_code=200)
-async def remove_floor_plan_item(request: Request, floor_plan_item_id: int, db: Session = Depends(get_db),
-                                 ):
+def remove_floor_plan_item(request: Request, floor_plan_item_id: int, db: Session = Depends(get_db),
+                           ):
     has_permission(request, PermissionSet.FloorEdit.value)
     db.query(FloorPlanItem).filter_by(id=floor_plan_item_id).delete()
     db.commit()
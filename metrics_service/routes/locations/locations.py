@@ -15,7 +15,7 @@ from utils import paginate
 
 
 @metrics_router.get("/headcount/", status_code=200, response_model=HeadcountModel)
-async def get_headcount(db: Session = Depends(get_db)):
+def get_headcount(db: Session = Depends(get_db)):
     buildings: List[Building] = db.query(Building).all()
     model = HeadcountModel()
     for building in buildings:
@@ -28,7 +28,7 @@ async def get_headcount(db: Session = Depends(get_db)):
 
 
 @metrics_router.get("/locations/", status_code=200, response_model=create_pagination_model(LocationModel))
-async def get_locations(request: Request, db: Session = Depends(get_db)):
+def get_locations(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.LocationRead.value)
     return paginate(
         db=db,
@@ -39,7 +39,7 @@ async def get_locations(request: Request, db: Session = Depends(get_db)):
 
 
 @metrics_router.post("/locations/", status_code=201, response_model=LocationModel)
-async def add_location(request: Request, body: AddLocationModel, db: Session = Depends(get_db)):
+def add_location(request: Request, body: AddLocationModel, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.LocationEdit.value)
     location = Location(name=body.name, latitude=body.latitude, longitude=body.longitude)
     db.add(location)
@@ -51,8 +51,8 @@ async def add_location(request: Request, body: AddLocationModel, db: Session = D
 
 
 @metrics_router.patch("/locations/{location_id}", status_code=200, response_model=LocationModel)
-async def patch_location(request: Request, location_id: int, body: ChangeLocationModel,
-                         db: Session = Depends(get_db), ):
+def patch_location(request: Request, location_id: int, body: ChangeLocationModel,
+                   db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.LocationEdit.value)
     location = db.query(Location).filter_by(id=location_id).first()
 
@@ -67,7 +67,7 @@ async def patch_location(request: Request, location_id: int, body: ChangeLocatio
 
 
 @metrics_router.delete("/locations/{location_id}/", status_code=200)
-async def remove_location(request: Request, location_id: int, db: Session = Depends(get_db)):
+def remove_location(request: Request, location_id: int, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.LocationEdit.value)
     db.query(Location).filter_by(id=location_id).delete()
     db.commit()
@@ -1,7 +1,8 @@
+import requests
 from fastapi import Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
-from auth_api import get_user
+from auth_api import get_user, get_users
 from db import get_db
 from models import PermissionSet
 from models.location import ResponsibleUser
@@ -14,28 +15,35 @@ from utils import apply_filtering
 
 @metrics_router.get("/responsible_users/", status_code=200,
                     response_model=create_pagination_model(ResponsibleUserModel))
-async def get_responsible_users(request: Request, db: Session = Depends(get_db)):
+def get_responsible_users(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingRead.value)
-    result_models, count, page_number = apply_filtering(
+    result_models, count, count_mode, page_number, next_after = apply_filtering(
         db=db,
         db_model=ResponsibleUser,
         request=request
     )
 
-    items = [{'id': user.id, 'rank': user.rank, 'building_id': user.building_id, 'user': get_user(user.user_id)} for
+    users = get_users(user.user_id for user in result_models)
+    items = [{'id': user.id, 'rank': user.rank, 'building_id': user.building_id, 'user': users.get(user.user_id)} for
              user in result_models]
     return {
         'total_size': count,
+        'total_size_mode': count_mode,
         'page_number': page_number,
         'page_size': len(items),
+        'next_after': next_after,
         'items': items
     }
 
 
 @metrics_router.post("/responsible_users/", status_code=201, response_model=ResponsibleUserModel)
-async def add_responsible_user(request: Request, body: AddResponsibleUserModel, db: Session = Depends(get_db), ):
+def add_responsible_user(request: Request, body: AddResponsibleUserModel, db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.BuildingEdit.value)
-    if not (user := get_user(body.user_id)):
+    try:
+        user = get_user(body.user_id)
+    except requests.RequestException:
+        raise HTTPException(detail='Auth service is unavailable', status_code=503)
+    if not user:
         raise HTTPException(detail='User does not exist', status_code=400)
     responsible_user = ResponsibleUser(**body.dict())
     db.add(responsible_user)
@@ -45,8 +53,8 @@ async def add_responsible_user(request: Request, body: AddResponsibleUserModel,
 
 
 @metrics_router.patch("/responsible_users/{responsible_user_id}", status_code=200, response_model=ResponsibleUserModel)
-async def patch_responsible_user(request: Request, responsible_user_id: int, body: ChangeResponsibleUserModel,
-                                 db: Session = Depends(get_db)):
+def patch_responsible_user(request: Request, responsible_user_id: int, body: ChangeResponsibleUserModel,
+                           db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.BuildingEdit.value)
     responsible_user = db.query(ResponsibleUser).filter_by(id=responsible_user_id).first()
 
@@ -61,7 +69,7 @@ async def patch_responsible_user(request: Request, responsible_user_id: int, bod
 
 
 @metrics_router.delete("/responsible_users/{responsible_user_id}/", status_code=200)
-async def remove_responsible_user(request: Request, responsible_user_id: int, db: Session = Depends(get_db), ):
+def remove_responsible_user(request: Request, responsible_user_id: int, db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.BuildingEdit.value)
     db.query(ResponsibleUser).filter_by(id=responsible_user_id).delete()
     db.commit()
@@ -69,7 +77,7 @@ async def remove_responsible_user(request: Request, responsible_user_id: int, db
 
 
 @metrics_router.delete("/responsible_users/users/{user_id}/", status_code=200)
-async def remove_responsible_user_by_user_id(request: Request, user_id: int, db: Session = Depends(get_db),):
+def remove_responsible_user_by_user_id(request: Request, user_id: int, db: Session = Depends(get_db),):
     has_permission(request, PermissionSet.BuildingEdit.value)
     db.query(ResponsibleUser).filter_by(user_id=user_id).delete()
     db.commit()
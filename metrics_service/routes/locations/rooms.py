@@ -14,7 +14,7 @@ from utils import paginate
 
 
 @metrics_router.get("/rooms/", status_code=200, response_model=create_pagination_model(RoomModel))
-async def get_rooms(request: Request, db: Session = Depends(get_db)):
+def get_rooms(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.RoomRead.value)
     return paginate(
         db=db,
@@ -25,7 +25,7 @@ async def get_rooms(request: Request, db: Session = Depends(get_db)):
 
 
 @metrics_router.post("/rooms/", status_code=201, response_model=RoomModel)
-async def add_room(request: Request, body: AddRoomModel, db: Session = Depends(get_db)):
+def add_room(request: Request, body: AddRoomModel, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.RoomEdit.value)
     room = Room(**body.dict())
     db.add(room)
@@ -37,7 +37,7 @@ async def add_room(request: Request, body: AddRoomModel, db: Session = Depends(g
 
 
 @metrics_router.patch("/rooms/{room_id}", status_code=200, response_model=RoomModel)
-async def patch_room(request: Request, room_id: int, body: ChangeRoomModel, db: Session = Depends(get_db), ):
+def patch_room(request: Request, room_id: int, body: ChangeRoomModel, db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.RoomEdit.value)
     room = db.query(Room).filter_by(id=room_id).first()
 
@@ -52,7 +52,7 @@ async def patch_room(request: Request, room_id: int, body: ChangeRoomModel, db:
 
 
 @metrics_router.delete("/rooms/{room_id}/", status_code=200)
-async def remove_room(request: Request, room_id: int, db: Session = Depends(get_db)):
+def remove_room(request: Request, room_id: int, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.RoomEdit.value)
     db.query(Room).filter_by(id=room_id).delete()
     db.commit()
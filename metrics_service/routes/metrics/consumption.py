@@ -0,0 +1,82 @@
+from datetime import datetime, time, timezone
+
+from fastapi import Depends, HTTPException, Query, Request
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from db import get_db
+from models import PermissionSet
+from models.metrics import HourlyMeterConsumption, DailyMeterConsumption, Meter, MeterType
+from permissions import has_permission
+from request_models import create_pagination_model
+from request_models.metrics_requests import HourlyMeterConsumptionModel, DailyMeterConsumptionModel, \
+    ConsumptionBucket, ConsumptionAggregationModel
+from routes import metrics_router
+from utils import paginate
+
+
+@metrics_router.get("/meter-consumption/hourly/", status_code=200,
+                    response_model=create_pagination_model(HourlyMeterConsumptionModel))
+def get_hourly_meter_consumption(request: Request, db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.MeterSnapshotRead.value)
+    return paginate(
+        db=db,
+        db_model=HourlyMeterConsumption,
+        serializer=HourlyMeterConsumptionModel,
+        request=request
+    )
+
+
+@metrics_router.get("/meter-consumption/daily/", status_code=200,
+                    response_model=create_pagination_model(DailyMeterConsumptionModel))
+def get_daily_meter_consumption(request: Request, db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.MeterSnapshotRead.value)
+    return paginate(
+        db=db,
+        db_model=DailyMeterConsumption,
+        serializer=DailyMeterConsumptionModel,
+        request=request
+    )
+
+
+@metrics_router.get("/consumption/", status_code=200, response_model=ConsumptionAggregationModel)
+def get_consumption(request: Request, start: datetime, end: datetime, bucket: ConsumptionBucket = ConsumptionBucket.day,
+                    building_id: int = None, meter_type: MeterType = Query(None, alias='type'),
+                    db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.MeterSnapshotRead.value)
+    # Rollup buckets are stored as naive UTC, offsets in the range are applied before comparing
+    start, end = (value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+                  for value in (start, end))
+    if start >= end:
+        raise HTTPException(detail='start has to be before end', status_code=400)
+
+    # Daily rollups are enough unless the buckets or the range boundaries are finer than a day
+    day_aligned = start.time() == time() and end.time() == time()
+    rollup = DailyMeterConsumption if bucket != ConsumptionBucket.hour and day_aligned else HourlyMeterConsumption
+
+    bucket_column = func.date_trunc(bucket.value, rollup.bucket).label('bucket')
+    total = func.sum(rollup.sum_consumption)
+    snapshot_count = func.sum(rollup.count)
+    query = db.query(
+        Meter.building_id,
+        Meter.type,
+        bucket_column,
+        total.label('total_consumption'),
+        (total / snapshot_count).label('average_consumption'),
+        snapshot_count.label('snapshot_count'),
+    ).join(Meter, Meter.id == rollup.meter_id).filter(rollup.bucket >= start, rollup.bucket < end)
+
+    if building_id is not None:
+        query = query.filter(Meter.building_id == building_id)
+    if meter_type is not None:
+        query = query.filter(Meter.type == meter_type)
+
+    query = query.group_by(Meter.building_id, Meter.type, bucket_column) \
+        .order_by(Meter.building_id, Meter.type, bucket_column)
+
+    return {
+        'start': start,
+        'end': end,
+        'bucket': bucket,
+        'items': [row._asdict() for row in query]
+    }
@@ -3,26 +3,26 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from db import get_db
+from meter_keys import get_meter_id_by_recognition_key, remember_meter, forget_meter, announce_key_change
 from models import PermissionSet
-from models.metrics import Meter, ElectricityMeter, MeterType
+from models.metrics import Meter, ElectricityMeter, MeterType, MeterSnapshot, LastMeterSnapshot
 from permissions import has_permission
 from request_models import create_pagination_model
 from request_models.metrics_requests import MeterModel, AddMeterModel, \
-    RecognizeMeterModel, ChangeMeterModel
+    RecognizeMeterModel, ChangeMeterModel, MeterSnapshotModel, LastMeterSnapshotModel
 from routes import metrics_router
 from utils import paginate
 
 
 @metrics_router.get("/meters/recognize/{recognition_key}/", status_code=201, response_model=RecognizeMeterModel)
-async def recognize_meter(recognition_key: str, db: Session = Depends(get_db)):
-    meter = db.query(Meter).filter(Meter.recognition_key == recognition_key).first()
-    if not meter:
+def recognize_meter(recognition_key: str, db: Session = Depends(get_db)):
+    if get_meter_id_by_recognition_key(db, recognition_key) is None:
         return {'meter_exists': False}
     return {'meter_exists': True}
 
 
 @metrics_router.get("/meters/", status_code=200, response_model=create_pagination_model(MeterModel))
-async def get_meters(request: Request, db: Session = Depends(get_db)):
+def get_meters(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.MeterRead.value)
     return paginate(
         db=db,
@@ -32,8 +32,35 @@ async def get_meters(request: Request, db: Session = Depends(get_db)):
     )
 
 
+@metrics_router.get("/meters/latest/", status_code=200, response_model=create_pagination_model(LastMeterSnapshotModel))
+def get_latest_meter_snapshots(request: Request, db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.MeterSnapshotRead.value)
+    # One row per meter kept up to date on ingest, the snapshots themselves aren't scanned
+    return paginate(
+        db=db,
+        db_model=LastMeterSnapshot,
+        serializer=LastMeterSnapshotModel,
+        request=request
+    )
+
+
+@metrics_router.get("/meters/{meter_id}/snapshots/", status_code=200,
+                    response_model=create_pagination_model(MeterSnapshotModel))
+def get_meter_snapshots_history(request: Request, meter_id: int, db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.MeterSnapshotRead.value)
+    if not db.query(Meter.id).filter_by(id=meter_id).first():
+        raise HTTPException(detail='Meter does not exist', status_code=404)
+    return paginate(
+        db=db,
+        db_model=MeterSnapshot,
+        serializer=MeterSnapshotModel,
+        request=request,
+        query=db.query(MeterSnapshot).filter(MeterSnapshot.meter_id == meter_id)
+    )
+
+
 @metrics_router.post("/meters/", status_code=201, response_model=MeterModel)
-async def add_meter(request: Request, body: AddMeterModel, db: Session = Depends(get_db)):
+def add_meter(request: Request, body: AddMeterModel, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.MeterEdit.value)
     meter_dict = body.dict()
     electricity = None
@@ -52,11 +79,12 @@ async def add_meter(request: Request, body: AddMeterModel, db: Session = Depends
     except IntegrityError:
         raise HTTPException(detail='Bad info', status_code=400)
 
+    remember_meter(meter)
     return MeterModel.from_orm(meter)
 
 
 @metrics_router.patch("/meters/{meter_id}", status_code=200, response_model=MeterModel)
-async def patch_meter(request: Request, meter_id: int, body: ChangeMeterModel, db: Session = Depends(get_db),):
+def patch_meter(request: Request, meter_id: int, body: ChangeMeterModel, db: Session = Depends(get_db),):
     has_permission(request, PermissionSet.MeterEdit.value)
     meter = db.query(Meter).filter_by(id=meter_id).first()
 
@@ -82,13 +110,18 @@ async def patch_meter(request: Request, meter_id: int, body: ChangeMeterModel, d
         meter.electricity = None
 
     db.merge(meter)
+    announce_key_change(db, meter.id)
     db.commit()
+    forget_meter(meter.id)
+    remember_meter(meter)
     return MeterModel.from_orm(meter)
 
 
 @metrics_router.delete("/meters/{meter_id}/", status_code=200)
-async def remove_meter(request: Request, meter_id: int, db: Session = Depends(get_db)):
+def remove_meter(request: Request, meter_id: int, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.MeterEdit.value)
     db.query(Meter).filter_by(id=meter_id).delete()
+    announce_key_change(db, meter_id)
     db.commit()
+    forget_meter(meter_id)
     return ""
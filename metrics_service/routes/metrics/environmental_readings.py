@@ -1,21 +1,23 @@
-from fastapi import Depends, HTTPException, Request
+from fastapi import Depends, HTTPException, Query, Request
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from db import get_db
+from export import ExportFormat, export_response
+from last_values import update_last_readings, refresh_last_readings, reading_row
 from models import PermissionSet
-from models.metrics import EnvironmentalReading
+from models.metrics import EnvironmentalReading, LastEnvironmentalReading
 from permissions import has_permission
 from request_models import create_pagination_model
 from request_models.metrics_requests import EnvironmentalReadingModel, \
-    AddEnvironmentalReadingModel, ChangeEnvironmentalReadingModel
+    AddEnvironmentalReadingModel, ChangeEnvironmentalReadingModel, LastEnvironmentalReadingModel
 from routes import metrics_router
-from utils import paginate
+from utils import paginate, filter_query
 
 
 @metrics_router.get("/rooms/environmental-readings/", status_code=200,
                     response_model=create_pagination_model(EnvironmentalReadingModel))
-async def get_environmental_readings(request: Request, db: Session = Depends(get_db)):
+def get_environmental_readings(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.RoomRead.value)
     return paginate(
         db=db,
@@ -25,13 +27,39 @@ async def get_environmental_readings(request: Request, db: Session = Depends(get
     )
 
 
+@metrics_router.get("/rooms/environmental-readings/latest/", status_code=200,
+                    response_model=create_pagination_model(LastEnvironmentalReadingModel))
+def get_latest_environmental_readings(request: Request, db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.RoomRead.value)
+    # One row per room kept up to date on ingest, the readings themselves aren't scanned
+    return paginate(
+        db=db,
+        db_model=LastEnvironmentalReading,
+        serializer=LastEnvironmentalReadingModel,
+        request=request
+    )
+
+
+@metrics_router.get("/rooms/environmental-readings/export/", status_code=200)
+def export_environmental_readings(request: Request,
+                                  export_format: ExportFormat = Query(ExportFormat.ndjson, alias='format'),
+                                  db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.RoomRead.value)
+    query_params = dict(request.query_params)
+    query_params.pop('format', None)
+    query = filter_query(db.query(*EnvironmentalReading.__table__.columns), EnvironmentalReading, query_params)
+    return export_response(query.statement, export_format, 'environmental_readings')
+
+
 @metrics_router.post("/rooms/environmental-readings/", status_code=201, response_model=EnvironmentalReadingModel)
-async def add_environmental_reading(request: Request, body: AddEnvironmentalReadingModel,
-                                    db: Session = Depends(get_db), ):
+def add_environmental_reading(request: Request, body: AddEnvironmentalReadingModel,
+                              db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.RoomEdit.value)
     environmental_reading = EnvironmentalReading(**body.dict())
     db.add(environmental_reading)
     try:
+        db.flush()
+        update_last_readings(db, [reading_row(environmental_reading)])
         db.commit()
     except IntegrityError:
         raise HTTPException(detail='EnvironmentalReading already exists', status_code=400)
@@ -40,10 +68,11 @@ async def add_environmental_reading(request: Request, body: AddEnvironmentalRead
 
 @metrics_router.patch("/rooms/environmental-readings/{environmental_reading_id}", status_code=200,
                       response_model=EnvironmentalReadingModel)
-async def patch_environmental_reading(request: Request, environmental_reading_id: int,
-                                      body: ChangeEnvironmentalReadingModel, db: Session = Depends(get_db), ):
+def patch_environmental_reading(request: Request, environmental_reading_id: int,
+                                body: ChangeEnvironmentalReadingModel, db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.RoomEdit.value)
     environmental_reading = db.query(EnvironmentalReading).filter_by(id=environmental_reading_id).first()
+    previous_room_id = environmental_reading.room_id
 
     args = {k: v for k, v in body.dict(exclude_unset=True).items()}
     if args:
@@ -51,13 +80,18 @@ async def patch_environmental_reading(request: Request, environmental_reading_id
             setattr(environmental_reading, k, v)
 
         db.add(environmental_reading)
+        db.flush()
+        refresh_last_readings(db, [previous_room_id, environmental_reading.room_id])
         db.commit()
     return EnvironmentalReadingModel.from_orm(environmental_reading)
 
 
 @metrics_router.delete("/rooms/environmental_readings/{environmental_reading_id}/", status_code=200)
-async def remove_environmental_reading(request: Request, environmental_reading_id: int, db: Session = Depends(get_db)):
+def remove_environmental_reading(request: Request, environmental_reading_id: int, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.RoomEdit.value)
+    room_id = db.query(EnvironmentalReading.room_id).filter_by(id=environmental_reading_id).scalar()
     db.query(EnvironmentalReading).filter_by(id=environmental_reading_id).delete()
+    if room_id:
+        refresh_last_readings(db, [room_id])
     db.commit()
     return ""
@@ -1,21 +1,35 @@
-from fastapi import Depends, HTTPException, Header, Request
+from datetime import datetime
+from typing import List
+
+import numpy as np
+from fastapi import Depends, HTTPException, Header, Query, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, func, cast, Float
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from db import get_db
+from downsampling import lttb, min_max
+from export import ExportFormat, export_response
+from ingestion import bulk_insert_snapshots, snapshot_buffer, INGEST_BUFFER_ENABLED, INGEST_FLUSH_INTERVAL_SEC, \
+    HEAT_COLUMNS, ELECTRICITY_COLUMNS
+from last_values import update_last_snapshots, refresh_last_snapshots, snapshot_row
+from meter_keys import get_meter_id_by_secret_key, get_meter_ids_by_secret_keys
 from models import PermissionSet
 from models.metrics import MeterSnapshot, HeatMeterSnapshot, \
-    ElectricityMeterSnapshot, MeterType, Meter
+    ElectricityMeterSnapshot, MeterType
 from permissions import has_permission
 from request_models import create_pagination_model
 from request_models.metrics_requests import MeterSnapshotModel, AddMeterSnapshotModel, ChangeMeterSnapshotModel, \
-    AddAutoMeterSnapshotModel
+    AddAutoMeterSnapshotModel, AddAutoMeterSnapshotBatchItemModel, MeterSnapshotBatchResultModel, \
+    MeterSnapshotSeriesModel, DownsamplingMethod
+from rollups import add_to_rollups, refresh_rollups
 from routes import metrics_router
-from utils import paginate
+from utils import paginate, filter_query
 
 
 @metrics_router.get("/meter-snapshots/", status_code=200, response_model=create_pagination_model(MeterSnapshotModel))
-async def get_meter_snapshots(request: Request, db: Session = Depends(get_db)):
+def get_meter_snapshots(request: Request, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.MeterSnapshotRead.value)
     return paginate(
         db=db,
@@ -25,8 +39,55 @@ async def get_meter_snapshots(request: Request, db: Session = Depends(get_db)):
     )
 
 
+@metrics_router.get("/meter-snapshots/export/", status_code=200)
+def export_meter_snapshots(request: Request, export_format: ExportFormat = Query(ExportFormat.ndjson, alias='format'),
+                           db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.MeterSnapshotRead.value)
+    heat_columns = [HeatMeterSnapshot.__table__.c[column].label(f'heat_{column}') for column in HEAT_COLUMNS]
+    electricity_columns = [ElectricityMeterSnapshot.__table__.c[column].label(f'electricity_{column}')
+                           for column in ELECTRICITY_COLUMNS]
+    query = db.query(*MeterSnapshot.__table__.columns, *heat_columns, *electricity_columns).select_from(MeterSnapshot) \
+        .outerjoin(HeatMeterSnapshot, HeatMeterSnapshot.snapshot_id == MeterSnapshot.id) \
+        .outerjoin(ElectricityMeterSnapshot, ElectricityMeterSnapshot.snapshot_id == MeterSnapshot.id)
+
+    query_params = dict(request.query_params)
+    query_params.pop('format', None)
+    query = filter_query(query, MeterSnapshot, query_params)
+    return export_response(query.statement, export_format, 'meter_snapshots')
+
+
+@metrics_router.get("/meter-snapshots/series/", status_code=200, response_model=MeterSnapshotSeriesModel)
+def get_meter_snapshot_series(request: Request, meter_id: int, start: datetime = None, end: datetime = None,
+                              points: int = Query(500, ge=3, le=10000),
+                              method: DownsamplingMethod = DownsamplingMethod.lttb, db: Session = Depends(get_db)):
+    has_permission(request, PermissionSet.MeterSnapshotRead.value)
+    # Plain floats from the database, converting datetimes and decimals row by row costs more than the downsampling
+    query = select([func.date_part('epoch', MeterSnapshot.creation_date), cast(MeterSnapshot.consumption, Float)]) \
+        .where(MeterSnapshot.meter_id == meter_id)
+    if start:
+        query = query.where(MeterSnapshot.creation_date >= start)
+    if end:
+        query = query.where(MeterSnapshot.creation_date < end)
+    rows = db.execute(query.order_by(MeterSnapshot.creation_date)).fetchall()
+
+    times = np.array([row[0] for row in rows], dtype=np.float64)
+    values = np.array([row[1] for row in rows], dtype=np.float64)
+    if method == DownsamplingMethod.lttb:
+        indices = lttb(times, values, points)
+    else:
+        indices = min_max(values, points)
+
+    return {
+        'meter_id': meter_id,
+        'method': method,
+        'raw_count': len(rows),
+        'time': [datetime.utcfromtimestamp(timestamp) for timestamp in times[indices]],
+        'consumption': values[indices].tolist()
+    }
+
+
 @metrics_router.post("/meter-snapshots/", status_code=201, response_model=MeterSnapshotModel)
-async def add_meter_snapshot(request: Request, body: AddMeterSnapshotModel, db: Session = Depends(get_db), ):
+def add_meter_snapshot(request: Request, body: AddMeterSnapshotModel, db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.MeterSnapshotEdit.value)
     snapshot_dict = body.dict()
     snapshot_dict['automatic'] = False
@@ -43,6 +104,9 @@ async def add_meter_snapshot(request: Request, body: AddMeterSnapshotModel, db:
     db.add(meter_snapshot)
 
     try:
+        db.flush()
+        add_to_rollups(db, [(meter_snapshot.meter_id, meter_snapshot.creation_date, meter_snapshot.consumption)])
+        update_last_snapshots(db, [snapshot_row(meter_snapshot)])
         db.commit()
     except IntegrityError:
         raise HTTPException(detail='Bad info', status_code=400)
@@ -51,16 +115,28 @@ async def add_meter_snapshot(request: Request, body: AddMeterSnapshotModel, db:
 
 
 @metrics_router.post("/meter-snapshots/auto/", status_code=201, response_model=MeterSnapshotModel)
-async def add_meter_snapshot_auto(body: AddAutoMeterSnapshotModel, db: Session = Depends(get_db),
-                                  secret_key: str = Header(None)):
-    meter = db.query(Meter).filter(Meter.secret_key == secret_key).first()
-    if not meter:
+def add_meter_snapshot_auto(body: AddAutoMeterSnapshotModel, db: Session = Depends(get_db),
+                            secret_key: str = Header(None)):
+    meter_id = get_meter_id_by_secret_key(db, secret_key)
+    if meter_id is None:
         raise HTTPException(status_code=400, detail="Wrong secret key")
     automatic = True
 
+    if body.type == MeterType.Electricity and not body.electricity:
+        raise HTTPException(status_code=400, detail='Electricity info is needed')
+
     snapshot_dict = body.dict()
     snapshot_dict['automatic'] = automatic
-    snapshot_dict['meter_id'] = meter.id
+    snapshot_dict['meter_id'] = meter_id
+
+    if INGEST_BUFFER_ENABLED:
+        # Stamped on arrival, the flush can be up to flush_interval later and even later after a requeue
+        snapshot_dict['creation_date'] = snapshot_dict.get('creation_date') or datetime.utcnow()
+        if not snapshot_buffer.put(snapshot_dict):
+            raise HTTPException(status_code=503, detail='Ingest buffer is full',
+                                headers={'Retry-After': str(max(1, round(INGEST_FLUSH_INTERVAL_SEC)))})
+        return JSONResponse(status_code=202, content={'detail': 'Accepted'})
+
     heat_dict = snapshot_dict.pop('heat', {})
     electricity_dict = snapshot_dict.pop('electricity', {})
 
@@ -74,6 +150,9 @@ async def add_meter_snapshot_auto(body: AddAutoMeterSnapshotModel, db: Session =
     db.add(meter_snapshot)
 
     try:
+        db.flush()
+        add_to_rollups(db, [(meter_snapshot.meter_id, meter_snapshot.creation_date, meter_snapshot.consumption)])
+        update_last_snapshots(db, [snapshot_row(meter_snapshot)])
         db.commit()
     except IntegrityError:
         raise HTTPException(detail='Bad info', status_code=400)
@@ -81,13 +160,54 @@ async def add_meter_snapshot_auto(body: AddAutoMeterSnapshotModel, db: Session =
     return MeterSnapshotModel.from_orm(meter_snapshot)
 
 
+@metrics_router.post("/meter-snapshots/auto/batch/", status_code=201, response_model=MeterSnapshotBatchResultModel)
+def add_meter_snapshots_auto_batch(body: List[AddAutoMeterSnapshotBatchItemModel], db: Session = Depends(get_db),
+                                   secret_key: str = Header(None)):
+    secret_keys = {item.secret_key or secret_key for item in body}
+    meter_ids = get_meter_ids_by_secret_keys(db, secret_keys)
+
+    statuses = []
+    snapshots = []
+    for index, item in enumerate(body):
+        meter_id = meter_ids.get(item.secret_key or secret_key)
+        if not meter_id:
+            statuses.append({'index': index, 'created': False, 'detail': 'Wrong secret key'})
+            continue
+        if item.type == MeterType.Electricity and not item.electricity:
+            statuses.append({'index': index, 'created': False, 'detail': 'Electricity info is needed'})
+            continue
+
+        snapshot_dict = item.dict(exclude={'secret_key'})
+        snapshot_dict['automatic'] = True
+        snapshot_dict['meter_id'] = meter_id
+        snapshots.append(snapshot_dict)
+        statuses.append({'index': index, 'created': True})
+
+    try:
+        snapshot_ids = iter(bulk_insert_snapshots(db, snapshots))
+        db.commit()
+    except IntegrityError:
+        raise HTTPException(detail='Bad info', status_code=400)
+
+    for item_status in statuses:
+        if item_status['created']:
+            item_status['id'] = next(snapshot_ids)
+
+    return {
+        'created': len(snapshots),
+        'failed': len(statuses) - len(snapshots),
+        'items': statuses
+    }
+
+
 @metrics_router.patch("/meter-snapshots/{meter_snapshot_id}", status_code=200, response_model=MeterSnapshotModel)
-async def patch_meter_snapshot(request: Request, meter_snapshot_id: int, body: ChangeMeterSnapshotModel,
-                               db: Session = Depends(get_db), ):
+def patch_meter_snapshot(request: Request, meter_snapshot_id: int, body: ChangeMeterSnapshotModel,
+                         db: Session = Depends(get_db), ):
     has_permission(request, PermissionSet.MeterSnapshotEdit.value)
     meter_snapshot = db.query(MeterSnapshot).filter_by(id=meter_snapshot_id).first()
 
     previous_type = meter_snapshot.type
+    previous_rollup_key = (meter_snapshot.meter_id, meter_snapshot.creation_date)
 
     snapshot_dict = body.dict(exclude_unset=True)
     heat_dict = snapshot_dict.pop('heat', {})
@@ -121,13 +241,23 @@ async def patch_meter_snapshot(request: Request, meter_snapshot_id: int, body: C
             meter_snapshot.heat_meter_snapshot = HeatMeterSnapshot(**heat_dict)
 
     db.merge(meter_snapshot)
+    if snapshot_dict.keys() & {'meter_id', 'creation_date', 'consumption'}:
+        db.flush()
+        refresh_rollups(db, [previous_rollup_key, (meter_snapshot.meter_id, meter_snapshot.creation_date)])
+    if snapshot_dict:
+        db.flush()
+        refresh_last_snapshots(db, [previous_rollup_key[0], meter_snapshot.meter_id])
     db.commit()
     return MeterSnapshotModel.from_orm(meter_snapshot)
 
 
 @metrics_router.delete("/meter-snapshots/{meter_snapshot_id}/", status_code=200)
-async def remove_meter_snapshot(request: Request, meter_snapshot_id: int, db: Session = Depends(get_db)):
+def remove_meter_snapshot(request: Request, meter_snapshot_id: int, db: Session = Depends(get_db)):
     has_permission(request, PermissionSet.MeterSnapshotEdit.value)
+    rollup_key = db.query(MeterSnapshot.meter_id, MeterSnapshot.creation_date).filter_by(id=meter_snapshot_id).first()
     db.query(MeterSnapshot).filter_by(id=meter_snapshot_id).delete()
+    if rollup_key:
+        refresh_rollups(db, [rollup_key])
+        refresh_last_snapshots(db, [rollup_key[0]])
     db.commit()
     return ""
@@ -0,0 +1,16 @@
+from fastapi import Depends, Request
+from sqlalchemy.orm import Session
+
+from auth_api import announce_evictions
+from db import get_db
+from permissions import has_server_api_key
+from request_models.location_requests import UserIdsModel
+from routes import metrics_router
+
+
+@metrics_router.post("/principals/evict/", status_code=200)
+def evict_cached_principals(request: Request, body: UserIdsModel, db: Session = Depends(get_db)):
+    has_server_api_key(request)
+    announce_evictions(db, body.user_ids)
+    db.commit()
+    return ""
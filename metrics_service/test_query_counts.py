@@ -0,0 +1,109 @@
+"""
+Number of queries of every paginated list endpoint on a seeded dataset. The counts only depend on the loading plan
+of the endpoint, not on the number of rows, so a lazy relationship read by a response model makes them fail.
+
+Needs TEST_POSTGRES_DB, see conftest.py.
+"""
+import os
+
+import pytest
+
+if not os.environ.get('TEST_POSTGRES_DB'):
+    pytest.skip('TEST_POSTGRES_DB is not set', allow_module_level=True)
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from db import db, engine, get_db
+from main import app
+
+
+@pytest.fixture(scope='module')
+def client():
+    # Permissions are not checked in DEBUG, the requests don't need tokens
+    monkeypatch = pytest.MonkeyPatch()
+    monkeypatch.setenv('DEBUG', 'True')
+    connection = engine.connect()
+    connection.begin()
+    session = db(bind=connection)
+    session.begin_nested()
+
+    # Commits of the routes end the savepoint instead of the outer transaction
+    @event.listens_for(session, 'after_transaction_end')
+    def restart_savepoint(session, transaction):
+        if transaction.nested and not transaction._parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+    def get_test_db():
+        yield session
+
+    app.dependency_overrides[get_db] = get_test_db
+    try:
+        yield TestClient(app)
+    finally:
+        del app.dependency_overrides[get_db]
+        event.remove(session, 'after_transaction_end', restart_savepoint)
+        # Closing them rolls back everything the tests wrote
+        session.close()
+        connection.close()
+        monkeypatch.undo()
+
+
+def post(client: TestClient, url: str, body: dict) -> dict:
+    response = client.post(url, json=body)
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+@pytest.fixture(scope='module')
+def dataset(client):
+    location = post(client, '/metrics/locations/', {'name': 'Query counts', 'longitude': 1, 'latitude': 2})
+    building_type = post(client, '/metrics/building-types/', {'name': 'Query counts'})
+    buildings, floors, meters = [], [], []
+    for building_index in range(3):
+        building = post(client, '/metrics/buildings/', {'name': f'Query counts {building_index}',
+                                                        'location_id': location['id'],
+                                                        'building_type_id': building_type['id']})
+        buildings.append(building)
+        for floor_index in range(3):
+            floor = post(client, '/metrics/floors/', {'building_id': building['id'], 'index': str(floor_index)})
+            floors.append(floor)
+            for room_index in range(3):
+                post(client, '/metrics/rooms/', {'floor_id': floor['id'], 'index': f'{floor_index}{room_index}'})
+        for meter_index, meter_type in enumerate(['Heat', 'Electricity', 'Water']):
+            body = {'building_id': building['id'], 'type': meter_type, 'model_number': 'M', 'manufacture_year': 2020,
+                    'serial_number': f'QC{building_index}{meter_index}'}
+            if meter_type == 'Electricity':
+                body['electricity'] = {'connection_type': 'direct', 'transformation_coefficient': '1'}
+            meters.append(post(client, '/metrics/meters/', body))
+        for consumption in range(3):
+            post(client, '/metrics/meter-snapshots/', {'meter_id': meters[-1]['id'], 'type': 'Water',
+                                                       'consumption': consumption})
+    return {'location': location, 'building_type': building_type, 'building': buildings[0], 'floor': floors[0],
+            'meter': meters[-1]}
+
+
+@pytest.mark.parametrize('url, query_count', [
+    ('/metrics/locations/?id={location[id]}', 9),
+    ('/metrics/buildings/?location_id={location[id]}', 8),
+    ('/metrics/floors/?building_id={building[id]}', 4),
+    ('/metrics/rooms/?floor_id={floor[id]}', 2),
+    ('/metrics/meters/?building_id={building[id]}', 3),
+    ('/metrics/meter-snapshots/?meter_id={meter[id]}', 2),
+])
+def test_list_query_count(client, dataset, url, query_count):
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        response = client.get(url.format(**dataset))
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+
+    assert response.status_code == 200, response.text
+    assert response.json()['items']
+    assert len(statements) == query_count, '\n\n'.join(statements)
@@ -1,71 +1,317 @@
-from typing import Type
+import base64
+import binascii
+import enum
+import json
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from typing import Type, Dict, List, Tuple, Optional, Sequence, FrozenSet, Callable
 
-from fastapi import Request
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import create_model
+from pydantic.fields import SHAPE_LIST
 from pydantic.main import BaseModel
-from sqlalchemy import desc, asc
-from sqlalchemy.orm import Session
+from sqlalchemy import desc, asc, tuple_, and_, or_, inspect
+from sqlalchemy.orm import Session, Query, Load, load_only, joinedload, selectinload
+from sqlalchemy.orm.attributes import InstrumentedAttribute
 
+from aggregation import parse_group_by, parse_aggregates, parse_aggregate_ordering
+from counts import CountMode, count_rows
 from db import Base
+from filters import filter_plan
 
+Ordering = List[Tuple[InstrumentedAttribute, bool]]
 
-def apply_filtering(db: Session, db_model: Type['Base'], request: Request):
-    query = db.query(db_model)
+# Cached fields=/expand= combinations, clients can ask for any number of them
+SPARSE_CACHE_SIZE = 256
 
-    query_params = dict(request.query_params)
+
+def parse_ordering(db_model: Type['Base'], order_by: Optional[str]) -> Ordering:
+    order_by = [s.strip() for s in order_by.split(',')] if order_by else []
+    return [(filter_plan(db_model).column(ordering.lstrip('-')), ordering.startswith('-')) for ordering in order_by]
+
+
+def order_query(query: Query, ordering: Ordering) -> Query:
+    return query.order_by(*[desc(column) if descending else asc(column) for column, descending in ordering])
+
+
+def _apply_filters(query: Query, db_model: Type['Base'], query_params: Dict[str, str]) -> Query:
+    return filter_plan(db_model).apply(query, query_params)
+
+
+def filter_query(query: Query, db_model: Type['Base'], query_params: Dict[str, str]) -> Query:
+    ordering = parse_ordering(db_model, query_params.pop('order_by', None))
+    return order_query(_apply_filters(query, db_model, query_params), ordering)
+
+
+def _cursor_value(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values: List) -> str:
+    return base64.urlsafe_b64encode(json.dumps([_cursor_value(value) for value in values]).encode()).decode()
+
+
+def decode_cursor(after: str, db_model: Type['Base'], ordering: Ordering) -> List:
+    """Key values of the `after` cursor parsed into the types of the ordering columns"""
+    parsers = filter_plan(db_model).parsers
+    try:
+        values = json.loads(base64.urlsafe_b64decode(after.encode()))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError(after)
+        return [parsers[column.key](value) if isinstance(value, str) else value
+                for (column, _), value in zip(ordering, values)]
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(detail='Invalid after cursor', status_code=400)
+
+
+def keyset_ordering(db_model: Type['Base'], ordering: Ordering) -> Ordering:
+    """The order_by keys with id appended as a tie breaker, a row is then identified by its key values"""
+    if not any(column is db_model.id for column, _ in ordering):
+        ordering = ordering + [(db_model.id, ordering[-1][1] if ordering else False)]
+    for column, _ in ordering:
+        if column.expression.nullable:
+            raise HTTPException(detail=f'after cursor can not be used with order_by={column.key}, it is nullable',
+                                status_code=400)
+    return ordering
+
+
+def seek_predicate(ordering: Ordering, values: List):
+    """Rows that come after the row with the key `values` in `ordering`"""
+    if len({descending for _, descending in ordering}) == 1:
+        keys = tuple_(*[column for column, _ in ordering])
+        return keys < tuple(values) if ordering[0][1] else keys > tuple(values)
+
+    clauses = []
+    for index, (column, descending) in enumerate(ordering):
+        previous_keys_equal = [previous == value for (previous, _), value in zip(ordering[:index], values)]
+        clauses.append(and_(*previous_keys_equal, column < values[index] if descending else column > values[index]))
+    return or_(*clauses)
+
+
+@lru_cache(maxsize=SPARSE_CACHE_SIZE)
+def loading_plan(db_model: Type['Base'], serializer: Type['BaseModel'], fields: Optional[FrozenSet[str]] = None,
+                 expand: Optional[FrozenSet[str]] = None) -> Tuple[Load, ...]:
+    """
+    Eager loading options for every relationship of `db_model` that `serializer` reads, nested serializers included.
+    Collections are loaded with one extra query per relationship (selectinload), single objects are joined.
+    `fields` and `expand` narrow `serializer` down as in sparse_serializer.
+    """
+    if fields is not None or expand is not None:
+        serializer = sparse_serializer(db_model, serializer, fields, expand)
+    return tuple(_deferred_columns(db_model, serializer, None) + _relationship_loaders(db_model, serializer, None))
+
+
+def _chain(parent: Optional[Load], strategy: Callable, *args) -> Load:
+    # Unbound loaders, a chain started with Load(db_model) drops the options after an of_type() relationship
+    return strategy(*args) if parent is None else getattr(parent, strategy.__name__)(*args)
+
+
+def _orm_attributes(serializer: Type['BaseModel']) -> Dict[str, str]:
+    """ORM attribute of every field of `serializer`, see request_models.read_from"""
+    renamed = getattr(serializer.__config__.getter_dict, 'orm_attributes', {})
+    return {name: renamed.get(name, name) for name in serializer.__fields__}
+
+
+def _deferred_columns(db_model: Type['Base'], serializer: Type['BaseModel'], loader: Optional[Load]) -> List[Load]:
+    columns = [column.key for column in inspect(db_model).mapper.column_attrs]
+    read_columns = [column for column in columns if column in _orm_attributes(serializer).values()]
+    return [_chain(loader, load_only, *read_columns)] if len(read_columns) < len(columns) else []
+
+
+def _relationship_loaders(db_model: Type['Base'], serializer: Type['BaseModel'],
+                          parent: Optional[Load]) -> List[Load]:
+    loaders = []
+    relationships = inspect(db_model).mapper.relationships
+    for name, attribute_name in _orm_attributes(serializer).items():
+        if attribute_name not in relationships:
+            continue
+        field = serializer.__fields__[name]
+        relationship = relationships[attribute_name]
+        attribute = getattr(db_model, attribute_name)
+        related_model = relationship.entity.entity
+        if relationship.entity.is_aliased_class:
+            # Relationship to a subquery, its own relationships are loaded through the aliased class
+            attribute = attribute.of_type(related_model)
+        loader = _chain(parent, selectinload if relationship.uselist else joinedload, attribute)
+        loaders.append(loader)
+        if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+            loaders.extend(_deferred_columns(related_model, field.type_, loader))
+            loaders.extend(_relationship_loaders(related_model, field.type_, loader))
+    return loaders
+
+
+def _path_set(value: Optional[str]) -> Optional[FrozenSet[str]]:
+    return None if value is None else frozenset(path.strip() for path in value.split(',') if path.strip())
+
+
+@lru_cache(maxsize=SPARSE_CACHE_SIZE)
+def sparse_serializer(db_model: Type['Base'], serializer: Type['BaseModel'], fields: Optional[FrozenSet[str]],
+                      expand: Optional[FrozenSet[str]]) -> Type['BaseModel']:
+    """
+    Copy of `serializer` with only the requested fields, both sets hold dotted paths such as `floors.rooms.index`.
+    Relationships are kept if they are in `expand`, plain fields of a model are kept if they are in `fields` or
+    if no field of that model is requested at all. `id` is always kept, None keeps everything.
+    """
+    known_paths = set()
+    model = _sparse_model(db_model, serializer, fields, expand, '', known_paths)
+    unknown_paths = ((fields or set()) | (expand or set())) - known_paths
+    if unknown_paths:
+        raise HTTPException(detail=f'Unknown or not expanded fields: {", ".join(sorted(unknown_paths))}',
+                            status_code=400)
+    return model
+
+
+def _sparse_model(db_model: Type['Base'], serializer: Type['BaseModel'], fields: Optional[FrozenSet[str]],
+                  expand: Optional[FrozenSet[str]], path: str, known_paths: set) -> Type['BaseModel']:
+    relationships = inspect(db_model).relationships
+    orm_attributes = _orm_attributes(serializer)
+    selected_fields = {field[len(path):] for field in fields or () if field.startswith(path)}
+    selected_fields = {field for field in selected_fields if '.' not in field}
+
+    definitions = {}
+    for name, field in serializer.__fields__.items():
+        field_path = f'{path}{name}'
+        field_type = field.outer_type_
+        if orm_attributes[name] in relationships:
+            if expand is not None and not any(e == field_path or e.startswith(f'{field_path}.') for e in expand):
+                continue
+            if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+                field_type = _sparse_model(relationships[orm_attributes[name]].mapper.class_, field.type_, fields,
+                                           expand, f'{field_path}.', known_paths)
+                field_type = List[field_type] if field.shape == SHAPE_LIST else field_type
+        elif selected_fields and name != 'id' and name not in selected_fields:
+            continue
+        known_paths.add(field_path)
+        definitions[name] = (field_type, ...) if field.required else (Optional[field_type], field.default)
+    return create_model(f'Sparse{serializer.__name__}', __config__=serializer.__config__, **definitions)
+
+
+def _page_params(query_params: Dict[str, str]) -> Tuple[int, int, CountMode]:
     page_number = int(query_params.pop('page_number', 1))
     page_size = int(query_params.pop('page_size', 10))
+    # Response shape, handled by paginate
+    query_params.pop('fields', None)
+    query_params.pop('expand', None)
+    try:
+        count_mode = CountMode(query_params.pop('count', CountMode.exact))
+    except ValueError:
+        raise HTTPException(detail=f'count has to be one of {", ".join(mode.value for mode in CountMode)}',
+                            status_code=400)
+    return page_number, page_size, count_mode
 
-    order_by = query_params.pop('order_by', None)
-    order_by = [s.strip() for s in order_by.split(',')] if order_by else []
-    for filter_arg, value in query_params.items():
-        filter_arg = filter_arg.split('__')
-        if len(filter_arg) > 1:
-            operator = filter_arg[1]
-        else:
-            operator = 'eq'
-        filter_arg = filter_arg[0]
-        if operator == 'gt':
-            query = query.filter(getattr(db_model, filter_arg) > value)
-        if operator == 'gte':
-            query = query.filter(getattr(db_model, filter_arg) >= value)
-        if operator == 'lt':
-            query = query.filter(getattr(db_model, filter_arg) < value)
-        if operator == 'lte':
-            query = query.filter(getattr(db_model, filter_arg) <= value)
-        if operator == 'eq':
-            query = query.filter(getattr(db_model, filter_arg) == value)
-        if operator == 'neq':
-            query = query.filter(getattr(db_model, filter_arg) != value)
-        if operator == 'icontains':
-            query = query.filter(getattr(db_model, filter_arg).ilike(f'%{value}%'))
-        if operator == 'in':
-            value = [s.strip() for s in value.split(',')]
-            query = query.filter(getattr(db_model, filter_arg).in_(value))
-
-    ordering_params = []
-    for ordering in order_by:
-        sign = ordering[0]
-        if sign == '-':
-            ordering_params.append(desc(getattr(db_model, ordering[1:])))
-        else:
-            ordering_params.append(asc(getattr(db_model, ordering)))
-
-    query = query.order_by(*ordering_params)
-    count = query.count()
-    query = query.limit(page_size).offset((page_number - 1) * page_size)
-
-    result_models = query.all()
-
-    return result_models, count, page_number
-
-
-def paginate(db: Session, db_model: Type['Base'], serializer: Type['BaseModel'], request: Request):
-    result_models, count, page_number = apply_filtering(db, db_model, request)
+
+def apply_filtering(db: Session, db_model: Type['Base'], request: Request, options: Sequence[Load] = (),
+                    query: Optional[Query] = None):
+    """
+    Filters, orders and paginates `db_model` by the query params. Pages are picked by `page_number` with OFFSET,
+    or by the `after` cursor taken from the `next_after` of the previous page (empty for the first page),
+    which seeks by the ordering keys so that deep pages cost the same as the first one.
+    The total size is counted in the `count` mode, see counts.CountMode. `options` are applied to the page query
+    only, usually the loading plan of the serializer. `query` narrows the rows down before the filters are applied.
+    """
+    if query is None:
+        query = db.query(db_model)
+
+    query_params = dict(request.query_params)
+    page_number, page_size, count_mode = _page_params(query_params)
+    after = query_params.pop('after', None)
+
+    ordering = parse_ordering(db_model, query_params.pop('order_by', None))
+    query = _apply_filters(query, db_model, query_params)
+    count = count_rows(query, db_model.__tablename__, count_mode)
+
+    if after is None:
+        result_models = order_query(query, ordering).options(*options).limit(page_size).offset(
+            (page_number - 1) * page_size).all()
+        return result_models, count, count_mode, page_number, None
+
+    ordering = keyset_ordering(db_model, ordering)
+    if after:
+        query = query.filter(seek_predicate(ordering, decode_cursor(after, db_model, ordering)))
+    result_models = order_query(query, ordering).options(*options).limit(page_size).all()
+
+    next_after = None
+    if result_models and len(result_models) == page_size:
+        next_after = encode_cursor([getattr(result_models[-1], column.key) for column, _ in ordering])
+    return result_models, count, count_mode, page_number, next_after
+
+
+def apply_aggregation(db: Session, db_model: Type['Base'], request: Request, query: Optional[Query] = None):
+    """
+    Groups of `db_model` filtered like apply_filtering, as one GROUP BY query: `group_by=room_id,current_time:day`
+    are the fields of the groups and `agg=avg:temperature,count:id` their aggregates, see aggregation.
+    The groups are paginated by `page_number` and can be ordered by their fields and aggregates.
+    """
+    if query is None:
+        query = db.query(db_model)
+
+    query_params = dict(request.query_params)
+    page_number, page_size, count_mode = _page_params(query_params)
+    if query_params.pop('after', None) is not None:
+        raise HTTPException(detail='after can not be used with group_by and agg, use page_number', status_code=400)
+    group_by = parse_group_by(db_model, query_params.pop('group_by', None))
+    aggregates = parse_aggregates(db_model, query_params.pop('agg', None))
+    ordering = parse_aggregate_ordering(group_by, aggregates, query_params.pop('order_by', None))
+
+    query = _apply_filters(query, db_model, query_params).with_entities(*group_by, *aggregates).group_by(*group_by)
+    count = count_rows(query, db_model.__tablename__, count_mode)
+    groups = query.order_by(*ordering).limit(page_size).offset((page_number - 1) * page_size).all()
+    return [group._asdict() for group in groups], count, count_mode, page_number
+
+
+def build_page(db: Session, db_model: Type['Base'], serializer: Type['BaseModel'], request: Request,
+               options: Optional[Sequence[Load]] = None, query: Optional[Query] = None) -> Tuple[Dict, bool]:
+    """
+    Paginated list of `db_model` serialized with `serializer` and whether it is sparse. `fields=` and `expand=`
+    narrow the serializer down with sparse_serializer, the columns and relationships left out are not loaded either.
+    With `group_by=` or `agg=` the page lists the groups of apply_aggregation instead, they are sparse too.
+    """
+    if 'group_by' in request.query_params or 'agg' in request.query_params:
+        groups, count, count_mode, page_number = apply_aggregation(db, db_model, request, query)
+        return {
+            'total_size': count,
+            'total_size_mode': count_mode,
+            'page_number': page_number,
+            'page_size': len(groups),
+            'next_after': None,
+            'items': groups
+        }, True
+
+    fields = _path_set(request.query_params.get('fields'))
+    expand = _path_set(request.query_params.get('expand'))
+    sparse = fields is not None or expand is not None
+    if options is None:
+        options = loading_plan(db_model, serializer, fields, expand)
+    if sparse:
+        serializer = sparse_serializer(db_model, serializer, fields, expand)
+    result_models, count, count_mode, page_number, next_after = apply_filtering(db, db_model, request, options,
+                                                                                query)
 
     items = [serializer.from_orm(obj) for obj in result_models]
     return {
         'total_size': count,
+        'total_size_mode': count_mode,
         'page_number': page_number,
         'page_size': len(items),
+        'next_after': next_after,
         'items': items
-    }
+    }, sparse
+
+
+def page_response(page: Dict, sparse: bool):
+    # The response_model of the route describes the full items, a sparse page skips its validation
+    return JSONResponse(jsonable_encoder(page)) if sparse else page
+
+
+def paginate(db: Session, db_model: Type['Base'], serializer: Type['BaseModel'], request: Request,
+             options: Optional[Sequence[Load]] = None, query: Optional[Query] = None):
+    return page_response(*build_page(db, db_model, serializer, request, options, query))